@@ -13,10 +13,31 @@ Purpose:
 ###############################################################################
 
 import pandas as pd # data science essentials (read_excel, DataFrame)
-import matplotlib.pyplot as plt # data visualization
+from diamond_plots import plt # data visualization (loaded lazily)
+from diamond_io import save_stage # columnar hand-off between stages
+from diamond_io import load_columns # memory-mapped copy of the workbook
+from diamond_versions import Snapshots # in-memory versions of the data
+from diamond_io import iter_excel_batches # batch reader for large files
+from diamond_missing import missing_profile, iter_flagged
+from diamond_missing import profile_missing, decode_missing
+from diamond_summary import RunningSummary # running missing value report
+from diamond_impute import impute_strategies # mean/median/dropped views
+from diamond_sketch import approximate_medians # streaming medians
+from diamond_impute import group_fills # fills by channel and store
+from diamond_impute import knn_impute # fills from similar diamonds
+from diamond_impute import chained_impute # fills from column models
+from diamond_impute import fit_imputer, ImputationFit # saved fill values
 
 file ='diamonds_missing_values.xlsx'
-diamonds = pd.read_excel(file)
+diamonds = load_columns(file) # reads the workbook only the first time
+
+# Keeping the raw data, so it can be restored without loading it again
+versions = Snapshots()
+
+versions.snapshot(diamonds, 'raw')
+
+# Set to True to also save each stage output as an Excel file
+export_excel = False
 
 
 
@@ -193,6 +214,70 @@ missing_ratio = missing_diamonds / total_diamonds
 missing_ratio.round(2)
 
 
+
+###############################################################################
+# Profiling missing values in one pass
+###############################################################################
+
+"""
+    Each of the checks above scans the whole dataset again. profile_missing
+    gets the counts and both ratios in a single scan, together with one
+    packed column (m_mask) that holds every missing value flag as a bit.
+"""
+
+profile, m_mask = profile_missing(diamonds)
+
+print(profile.round(2))
+
+
+
+# The flag of a single column can be read back from the mask
+decode_missing(m_mask, 'carat').sum() == diamonds['carat'].isnull().sum()
+
+
+
+###############################################################################
+# Checking for missing values in batches
+###############################################################################
+
+"""
+    For exports too large to load at once, the same counts can be built
+    one batch of rows at a time. Memory use depends on batch_size, not on
+    the size of the file.
+"""
+
+batch_size = 100000
+
+
+profile = missing_profile(iter_excel_batches(file, batch_size = batch_size))
+
+print(profile)
+
+
+
+# The missing value flags can be added batch by batch as well
+for batch in iter_flagged(iter_excel_batches(file, batch_size = batch_size)):
+    print(batch.iloc[:, -4:].sum())
+
+
+
+# A running summary (counts, sums, min/max and quartile sketches) is kept
+# next to the data. A new export is then added with
+# append_summary('diamonds_missing_values', new_batch), which only reads
+# the new rows, and the report no longer needs the full dataset.
+summary = RunningSummary()
+
+for batch in iter_excel_batches(file, batch_size = batch_size):
+    summary.update(batch)
+
+summary.save('diamonds_missing_values')
+
+print(summary.profile())
+
+print(summary.describe())
+
+
+
 ###############################################################################
 # Flagging missing values
 ###############################################################################
@@ -275,7 +360,7 @@ diamonds['carat'].isnull().sum() == diamonds['m_carat'].sum()
 
 
 # Resetting the dataset
-diamonds = pd.read_excel(file)
+diamonds = versions.restore('raw')
 
 
 
@@ -312,15 +397,24 @@ else:
 
 # Start by creating three different datasets
 
+"""
+    Instead of copying the whole DataFrame once per strategy, the mean,
+    median and drop statistics are computed in a single scan. Each strategy
+    is a view over diamonds that only stores the filled cells (or, for
+    df_dropped, which rows to keep). Columns are built when they are used.
+"""
 
-# The following code copies and makes each DataFrame independent
-df_mean  = pd.DataFrame.copy(diamonds)
+strategies = impute_strategies(diamonds)
 
 
-df_median = pd.DataFrame.copy(df_mean)
+df_mean = strategies['mean']
 
 
-df_dropped = pd.DataFrame.copy(df_median)
+df_median = strategies['median']
+
+
+df_dropped = strategies['dropped']
+
 
 
 # We could fill each column one-by-one
@@ -337,40 +431,8 @@ diamonds['carat'] = (diamonds['carat']
 
 
 
-# ... or we could create a loop
-for col in df_mean:
-    
-    """ Impute missing values using the mean of each column """
-    
-    if df_mean[col].isnull().any():
-        
-        col_mean = df_mean[col].mean()
-        
-        df_mean[col] = df_mean[col].fillna(col_mean).round(2)
-
-
-# See Footnote 9 for a breakdown of the code above
-
-
-
-# Creating a loop for df_median
-for col in df_median:
-    
-    """ Impute missing values using the mean of each column """
-    
-    if df_median[col].isnull().any():
-        
-        col_median = df_median[col].median()
-        
-        df_median[col] = df_median[col].fillna(col_median).round(2)
-
-
-
-# Using dropna() for df_dropped
-df_dropped = df_dropped.dropna().round(2)
-
-
-# See Footnote 10 for a breakdown of the code above
+# The strategies above were taken before this change, so they still see
+# the original carat values
 
 
 
@@ -394,21 +456,15 @@ diamonds.mean() == df_mean.mean()
 
 
 # Also, there should be no missing values in our new datasets
-print(df_mean.isnull()
-                .any()
-                .any())
+print(df_mean.has_missing())
 
 
 
-print(df_median.isnull()
-                .any()
-                .any())
+print(df_median.has_missing())
 
 
 
-print(df_dropped.isnull()
-                .any()
-                .any())
+print(df_dropped.has_missing())
 
 
 # See Footnote 11 for an explanation of the code above
@@ -544,6 +600,95 @@ print(diamonds['clarity'].isnull().any())
 
 
 
+###############################################################################
+# Median imputation for data larger than memory
+###############################################################################
+
+"""
+    median() needs the whole column in memory. For exports that do not
+    fit, a quantile sketch (see diamond_sketch) is built while the batches
+    stream in. Its median is within about 1.7% (in rank) of the true
+    median, and sketches built on different machines can be merged.
+"""
+
+medians = approximate_medians(iter_excel_batches(file, batch_size = batch_size),
+                              columns = ['carat', 'color', 'cut'])
+
+print(medians)
+
+
+
+###############################################################################
+# Imputing by channel and store
+###############################################################################
+
+"""
+    Prices and carats differ by channel and store, so we can also fill each
+    missing value from the diamonds sold by the same store. The statistics
+    of every (channel, store) group come from one groupby and are kept in
+    a small lookup table; stores with fewer than 10 known values use the
+    overall median (or mean for clarity).
+"""
+
+raw = versions.restore('raw')
+
+
+fills = group_fills(raw, min_count = 10)
+
+print(fills.table)
+
+
+
+# Filling all rows at once from the lookup table
+by_store = fills.fill(raw)
+
+print(by_store[['carat', 'color', 'clarity', 'cut']].isnull().any())
+
+
+
+# Or from the 5 most similar complete diamonds of the same store, found
+# with a KD-tree instead of comparing every pair of diamonds
+by_neighbours = knn_impute(raw, k = 5)
+
+print(by_neighbours.loc[raw['carat'].isnull(), ['carat', 'price', 'store']])
+
+
+
+# Or from linear models of each column on the others (chained equations),
+# repeated until the filled values stop changing
+by_model, history = chained_impute(raw, max_iter = 10)
+
+print(pd.DataFrame(history))
+
+
+
+###############################################################################
+# Imputing new batches with a saved fit
+###############################################################################
+
+"""
+    The fill values above (carat mean, color and cut median, clarity mean)
+    only need to be computed once. The fit is saved to a small JSON file,
+    and batches that arrive later are imputed from it without reading the
+    full dataset again.
+"""
+
+imputer = fit_imputer(raw)
+
+imputer.save('diamonds_imputer')
+
+print(imputer.fills)
+
+
+
+# A later batch only needs the saved fit
+imputer = ImputationFit.load('diamonds_imputer')
+
+for batch in iter_excel_batches(file, batch_size = batch_size):
+    print(imputer.transform(batch).isnull().sum().sum())
+
+
+
 ###############################################################################
 # Checking data after imputation
 ###############################################################################
@@ -592,5 +737,5 @@ plt.show()
 # Saving things for future use
 ###############################################################################
 
-# saving dataset
-diamonds.to_excel('diamonds_imputed.xlsx', index = False)
+# saving dataset (diamonds_imputed.parquet, plus .xlsx if export_excel)
+save_stage(diamonds, 'diamonds_imputed', excel = export_excel)
@@ -12,12 +12,27 @@ Purpose:
 ###############################################################################
 # Importing libraries and base dataset
 ###############################################################################
-import pandas as pd # data science essentials
-import matplotlib.pyplot as plt # data visualization
-import seaborn as sns # more data visualization
+from diamond_plots import plt, sns # data visualization (loaded lazily)
+from diamond_plots import plot_frame # pandas plots, skipped if compute-only
+from diamond_io import load_columns, save_stage # columnar hand-off
+from diamond_versions import Snapshots # in-memory versions of the data
+from diamond_outliers import add_outlier_flags # vectorized outlier flags
+from diamond_outliers import compile_rules, load_rules, add_rule_flags
+from diamond_outliers import outlier_fences, add_fence_flags # data fences
+from diamond_outliers import StreamingScorer # flags listings as they arrive
+from diamond_outliers import add_robust_flags # multivariate outliers
+from diamond_pipeline import robust_outliers # adds out_robust if True
 
-file ='diamonds_imputed.xlsx'
-diamonds = pd.read_excel(file)
+file ='diamonds_imputed'
+diamonds = load_columns(file)
+
+# Keeping the imputed data, so it can be restored without loading it again
+versions = Snapshots()
+
+versions.snapshot(diamonds, 'imputed')
+
+# Set to True to also save each stage output as an Excel file
+export_excel = False
 
 
 
@@ -50,24 +65,24 @@ diamonds[['carat',
 # Using boxplots for distribution analysis
 
 # A basic boxplot
-diamonds.boxplot(column = ['carat'])
+plot_frame(diamonds).boxplot(column = ['carat'])
 
 
 
 # A boxplot that's segmented
-diamonds.boxplot(column = ['carat'],
-                  by = 'channel',)
+plot_frame(diamonds).boxplot(column = ['carat'],
+                              by = 'channel',)
 
 
 
 # A more advanced boxplot that segmented
-diamonds.boxplot(column = ['carat'],
-                 by = 'channel',
-                 vert = False,
-                 manage_xticks = True,
-                 patch_artist = False,
-                 meanline = True,
-                 showmeans = True)
+plot_frame(diamonds).boxplot(column = ['carat'],
+                             by = 'channel',
+                             vert = False,
+                             manage_xticks = True,
+                             patch_artist = False,
+                             meanline = True,
+                             showmeans = True)
 
 
 plt.title("Carat by Channel")
@@ -80,12 +95,12 @@ plt.show()
 # ...and a more advanced set of boxplots
 
 # carat
-diamonds.boxplot(column = ['carat'],
-                 by = 'channel',
-                 vert = False,
-                 patch_artist = True,
-                 meanline = True,
-                 showmeans = True)
+plot_frame(diamonds).boxplot(column = ['carat'],
+                             by = 'channel',
+                             vert = False,
+                             patch_artist = True,
+                             meanline = True,
+                             showmeans = True)
 
 
 
@@ -97,12 +112,12 @@ plt.show()
 
 
 # color
-diamonds.boxplot(column = ['color'],
-                 by = 'channel',
-                 vert = False,
-                 patch_artist = True,
-                 meanline = True,
-                 showmeans = True)
+plot_frame(diamonds).boxplot(column = ['color'],
+                             by = 'channel',
+                             vert = False,
+                             patch_artist = True,
+                             meanline = True,
+                             showmeans = True)
 
 
 plt.suptitle('')
@@ -112,12 +127,12 @@ plt.show()
 
 
 # clarity
-diamonds.boxplot(column = ['clarity'],
-                 by = 'channel',
-                 vert = False,
-                 patch_artist = True,
-                 meanline = True,
-                 showmeans = True)
+plot_frame(diamonds).boxplot(column = ['clarity'],
+                             by = 'channel',
+                             vert = False,
+                             patch_artist = True,
+                             meanline = True,
+                             showmeans = True)
 
 plt.suptitle('')
 plt.tight_layout()
@@ -126,12 +141,12 @@ plt.show()
 
 
 # cut
-diamonds.boxplot(column = ['cut'],
-                 by = 'channel',
-                 vert = False,
-                 patch_artist = True,
-                 meanline = True,
-                 showmeans = True)
+plot_frame(diamonds).boxplot(column = ['cut'],
+                             by = 'channel',
+                             vert = False,
+                             patch_artist = True,
+                             meanline = True,
+                             showmeans = True)
 
 plt.suptitle('')
 plt.tight_layout()
@@ -140,13 +155,13 @@ plt.show()
 
 
 # carat, color, clarity, and cut
-diamonds.boxplot(column = ['carat', 'color', 'clarity', 'cut'],
-                 vert = False,
-                 manage_xticks = True,
-                 patch_artist = False,
-                 meanline = True,
-                 showmeans = True,
-                 )
+plot_frame(diamonds).boxplot(column = ['carat', 'color', 'clarity', 'cut'],
+                             vert = False,
+                             manage_xticks = True,
+                             patch_artist = False,
+                             meanline = True,
+                             showmeans = True,
+                             )
 
 
 plt.title("Boxplots for Carat, Color, Clarity, and Cut")
@@ -177,7 +192,7 @@ plt.show()
 ###############################################################################
 
 # Using pandas
-diamonds['price'].hist()
+plot_frame(diamonds['price']).hist()
 
 plt.xlabel("Price")
 plt.show()
@@ -487,24 +502,32 @@ plt.show()
 # Flagging outliers
 ###############################################################################
 
-diamonds = pd.read_excel(file)
+diamonds = versions.restore('imputed')
 
 
-########################
-# price
-########################
+"""
+    Every flag (price, carat by channel, clarity, color and cut) and their
+    sum are computed at once by comparing whole columns with the limits
+    above, instead of looping over the rows.
+"""
 
-# Writing a variable for outlier flags
-diamonds['out_price'] = 0
+limits = {'price_hi'   : price_limit_hi,
+          'carat_hi'   : {0: carat_limit_0,
+                          1: carat_limit_1,
+                          2: carat_limit_2},
+          'clarity_lo' : clarity_limit_lo,
+          'clarity_hi' : clarity_limit_hi,
+          'color_hi'   : color_limit_hi,
+          'cut_flag'   : 1}
 
 
-# Building a for loop
-for val in enumerate(diamonds.loc[ : , 'price']):
-    
-    if val[1] > price_limit_hi:
-        diamonds.loc[val[0], 'out_price'] = 1
+diamonds = add_outlier_flags(diamonds, limits)
+
 
 
+########################
+# price
+########################
 
 # Checking to see how many outliers were flagged
 diamonds['out_price'].abs().sum()
@@ -515,15 +538,6 @@ check = (diamonds.loc[ : , ['price', 'out_price']]
                                           ascending = False))
 
 
-for val in enumerate(diamonds['price']):
-    
-    if val[1] > price_limit_hi:
-        diamonds['out_price'][val[0]] = 1
-
-
-diamonds['out_price'].abs().sum()
-
-
 
 ########################
 # A more surgical approach to outlier flagging
@@ -533,145 +547,158 @@ diamonds['out_price'].abs().sum()
 # carat
 ########################
 
+diamonds['out_carat'].abs().sum()
 
-diamonds['out_carat'] = 0
 
+check = (diamonds.loc[ : , ['channel', 'carat', 'out_carat']]
+                             .sort_values(['channel', 'carat'],
+                                          ascending = False))
 
-for val in enumerate(diamonds.loc[ : , 'carat']):
-    
-    if diamonds.loc[val[0], 'channel'] == 0 and val[1] > carat_limit_0:
-        
-        diamonds.loc[val[0], 'out_carat'] = 1
+########################
+# clarity
+########################
 
+diamonds['out_clarity'].abs().sum()
 
 
-for val in enumerate(diamonds.loc[ : , 'carat']):
+check = (diamonds.loc[ : , ['clarity', 'out_clarity']]
+                             .sort_values(['clarity'],
+                                          ascending = False))
 
-    if diamonds.loc[val[0], 'channel'] == 1 and val[1] > carat_limit_1:
-        
-        diamonds.loc[val[0], 'out_carat'] = 1
 
 
+########################
+# color
+########################
 
-for val in enumerate(diamonds.loc[ : , 'carat']):
+# Checking to see how many outliers were flagged
+diamonds['out_color'].abs().sum()
     
-    if diamonds.loc[val[0], 'channel'] == 2 and val[1] > carat_limit_2:
-        
-        diamonds.loc[val[0], 'out_carat'] = 1
 
+check = (diamonds.loc[ : , ['color', 'out_color']]
+                             .sort_values('color',
+                                          ascending = False))
 
-        
 
-diamonds['out_carat'].abs().sum()
 
 
-check = (diamonds.loc[ : , ['channel', 'carat', 'out_carat']]
-                             .sort_values(['channel', 'carat'],
-                                          ascending = False))
 
 ########################
-# clarity
+# cut
 ########################
 
-diamonds['out_clarity'] = 0
-
-
-for val in enumerate(diamonds.loc[ : , 'clarity']):
-    
-    if val[1] < clarity_limit_lo:
-        diamonds.loc[val[0], 'out_clarity'] = 1
+diamonds['out_cut'].abs().sum()
 
 
 
-for val in enumerate(diamonds.loc[ : , 'clarity']):
-    
-    if val[1] > clarity_limit_hi:
-        diamonds.loc[val[0], 'out_clarity'] = 1
+check = (diamonds.loc[ : , ['cut', 'out_cut']]
+                             .sort_values(['cut'],
+                                          ascending = False))
 
 
 
-diamonds['out_clarity'].abs().sum()
 
+########################
+# Analyzing outlier flags
+########################
 
-check = (diamonds.loc[ : , ['clarity', 'out_clarity']]
-                             .sort_values(['clarity'],
+check = (diamonds.loc[ : , ['out_sum',
+                            'out_price',
+                            'out_carat',
+                            'out_clarity',
+                            'out_color',
+                            'out_cut']].sort_values(['out_sum'],
                                           ascending = False))
 
 
 
 ########################
-# color
+# Outliers in combination
 ########################
 
-diamonds['out_color'] = 0
-
-
-# Building a for loop
-for val in enumerate(diamonds.loc[ : , 'color']):
-    
-    if val[1] > color_limit_hi:
-        diamonds.loc[val[0], 'out_color'] = 1
-
-
+"""
+    A diamond can look normal on every column and still be unusual as a
+    whole, such as a high price for a small carat. robust_distance measures
+    how far each diamond is from the typical diamond of its channel,
+    taking carat, color, clarity and price together, and out_robust flags
+    the most unusual ones. It is kept next to out_sum, not added to it.
+    Channels 0 and 1 have too few diamonds for a reliable fit, so their
+    robust_distance is missing and they are never flagged here.
+
+    As in the pipeline, this only runs with robust_outliers = True in
+    diamond_pipeline.py, so the saved stage file has the same columns
+    whichever of the two wrote it.
+"""
 
-# Checking to see how many outliers were flagged
-diamonds['out_color'].abs().sum()
-    
+if robust_outliers:
 
-check = (diamonds.loc[ : , ['color', 'out_color']]
-                             .sort_values('color',
-                                          ascending = False))
+    diamonds = add_robust_flags(diamonds, by = 'channel')
 
 
+    check = (diamonds.loc[ : , ['out_sum',
+                                'out_robust',
+                                'robust_distance',
+                                'carat',
+                                'price']].sort_values(['robust_distance'],
+                                              ascending = False))
 
 
 
 ########################
-# cut
+# Flags from a rule file
 ########################
 
-diamonds['out_cut'] = 0
+# outlier_rules.json holds the same limits as rules such as
+# "carat > 2.03 where channel == 0", so they can be changed without editing
+# this script
+rules = compile_rules(load_rules('outlier_rules.json'))
 
+rule_flags = add_rule_flags(versions.restore('imputed'), rules)
 
+(rule_flags['out_sum'] == diamonds['out_sum']).all()
 
-for val in enumerate(diamonds.loc[ : , 'cut']):
-    
-    if val[1] == 1:
-        diamonds.loc[val[0], 'out_cut'] = 1
 
 
+########################
+# Fences computed from the data
+########################
 
-diamonds['out_cut'].abs().sum()
+"""
+    Instead of limits picked by eye, each channel can get its own fences
+    from its quartiles (Tukey's 1.5 * IQR rule), or from its median and
+    median absolute deviation with method = 'mad'.
+"""
 
+fences = outlier_fences(versions.restore('imputed'), by = ['channel'],
+                        method = 'iqr')
 
+print(fences.round(2).T)
 
-check = (diamonds.loc[ : , ['cut', 'out_cut']]
-                             .sort_values(['cut'],
-                                          ascending = False))
 
+fence_flags = add_fence_flags(versions.restore('imputed'), fences)
+
+fence_flags.loc[ : , fence_flags.columns.str.startswith('out_')].sum()
 
 
 
 ########################
-# Analyzing outlier flags
+# Flagging new listings as they arrive
 ########################
 
-diamonds['out_sum'] = (diamonds['out_price']   +
-                       diamonds['out_carat']   +
-                       diamonds['out_clarity']   +
-                       diamonds['out_color'] +
-                       diamonds['out_cut'])
+"""
+    The scorer keeps running quartiles of each channel, so listings can be
+    flagged in small batches as they come in, each against everything seen
+    before it. A channel is only flagged once it has min_count (20)
+    listings, so the first listings of every channel are never flagged.
+"""
 
+scorer = StreamingScorer(by = 'channel', method = 'iqr')
 
+for start in range(0, len(diamonds), 100):
 
+    batch = versions.restore('imputed').iloc[start : start + 100]
 
-check = (diamonds.loc[ : , ['out_sum',
-                            'out_price',
-                            'out_carat',
-                            'out_clarity',
-                            'out_color',
-                            'out_cut']].sort_values(['out_sum'],
-                                          ascending = False))
+    print(scorer.score(batch)['out_sum'].sum())
 
 
 
@@ -679,6 +706,6 @@ check = (diamonds.loc[ : , ['out_sum',
 # Saving things for future use
 ###############################################################################
 
-diamonds.to_excel('diamonds_flagged.xlsx', index = False)
+save_stage(diamonds, 'diamonds_flagged', excel = export_excel)
 
 
@@ -12,11 +12,14 @@ Purpose:
 # Importing libraries and base dataset
 ###############################################################################
 import pandas as pd # data science essentials
-import matplotlib.pyplot as plt # data visualization
-import seaborn as sns # more data visualization
+from diamond_plots import plt, sns # data visualization (loaded lazily)
+from diamond_io import load_columns, save_stage # columnar hand-off
 
-file ='diamonds_flagged.xlsx'
-diamonds = pd.read_excel(file)
+file ='diamonds_flagged'
+diamonds = load_columns(file)
+
+# Set to True to also save each stage output as an Excel file
+export_excel = False
 
 
 ###############################################################################
@@ -493,4 +496,4 @@ print(f"""
 # Saving things for future use
 ###############################################################################
 
-diamonds.to_excel('diamonds_explored.xlsx', index = False)
+save_stage(diamonds, 'diamonds_explored', excel = export_excel)
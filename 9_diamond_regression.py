@@ -11,14 +11,20 @@ Purpose:
 # Importing libraries and base dataset
 ###############################################################################
 import pandas as pd # data science essentials
-import matplotlib.pyplot as plt # data visualization
-import seaborn as sns # more data visualization
-import statsmodels.api as sm
 import statsmodels.formula.api as smf # regression modeling
-import statsmodels.graphics as smg
+from diamond_plots import plt, sns # data visualization (loaded lazily)
+import diamond_plots # compute_only is read when it is checked
+from diamond_plots import lazy_import
 
-file ='diamonds_explored.xlsx'
-diamonds = pd.read_excel(file)
+sm = lazy_import('statsmodels.api') # only used for plots
+smg = lazy_import('statsmodels.graphics')
+from diamond_io import load_columns, save_stage # columnar hand-off
+
+file ='diamonds_explored'
+diamonds = load_columns(file)
+
+# Set to True to also save each stage output as an Excel file
+export_excel = False
 
 
 ###############################################################################
@@ -266,7 +272,9 @@ A diamond of that size will cost approximately {round(pred_price, 2)}.
 
       """)
 
-price_pred()
+# price_pred() waits for keyboard input, so it is skipped in batch jobs
+if not diamond_plots.compute_only:
+    price_pred()
 
 # We can refine our fuction using confidence intervals.
 results.conf_int()
@@ -842,4 +850,4 @@ diamonds = pd.concat(
          axis = 1)
 
 
-diamonds.to_excel('diamonds_wide.xlsx', index = False)
+save_stage(diamonds, 'diamonds_wide', excel = export_excel)
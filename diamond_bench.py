@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+
+@author: ArthurFMendes
+
+Purpose:
+    This code is meant to measure how each step of the diamond analysis
+    scales with the number of rows (wall time, peak memory and rows per
+    second), and to save the results for later comparison.
+"""
+
+###############################################################################
+# Importing libraries
+###############################################################################
+
+import argparse
+import json
+import os
+import platform
+import resource
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np # fast arrays
+import pandas as pd # data science essentials
+
+import diamond_pipeline as pipeline
+from diamond_synth import synthetic_frame
+
+
+
+###############################################################################
+# Benchmark data
+###############################################################################
+
+def make_rows(rows, seed = 0):
+    """Returns a raw diamond dataset of the given size (see diamond_synth)."""
+
+    return synthetic_frame(rows, seed = seed)
+
+
+
+###############################################################################
+# Benchmarked steps
+###############################################################################
+
+"""
+    Each benchmark names the input it needs (the raw data, or the data
+    after imputation, flagging or exploration) and gets that input as a
+    DataFrame. It returns a function that runs the step being timed. The
+    input is prepared in another process and saved to a file, so neither
+    the time nor the memory of preparing it (for example imputing before
+    flagging outliers) is part of the measurement.
+"""
+
+def _explored(raw):
+
+    return pipeline.explore(
+                pipeline.flag_outliers(pipeline.impute_missing(raw)))
+
+
+
+# input name: function building it from the raw data
+inputs = {'raw'      : lambda raw: raw,
+          'imputed'  : pipeline.impute_missing,
+          'flagged'  : lambda raw: pipeline.flag_outliers(
+                                        pipeline.impute_missing(raw)),
+          'explored' : _explored}
+
+
+
+def _bench_impute(raw):
+
+    return lambda: pipeline.impute_missing(raw)
+
+
+
+def _bench_flag(imputed):
+
+    return lambda: pipeline.flag_outliers(imputed)
+
+
+
+def _bench_flag_loops(imputed):
+    """The row-by-row loops of the original stage 7: all five flags (with
+    one scan of carat per channel) and their sum, as the vectorized flag
+    benchmark computes."""
+
+    def run():
+
+        imputed['out_price'] = 0
+
+        for val in enumerate(imputed.loc[ : , 'price']):
+
+            if val[1] > pipeline.price_limit_hi:
+                imputed.loc[val[0], 'out_price'] = 1
+
+
+        imputed['out_carat'] = 0
+
+        for channel, limit in [(0, pipeline.carat_limit_0),
+                               (1, pipeline.carat_limit_1),
+                               (2, pipeline.carat_limit_2)]:
+
+            for val in enumerate(imputed.loc[ : , 'carat']):
+
+                if (imputed.loc[val[0], 'channel'] == channel and
+                        val[1] > limit):
+                    imputed.loc[val[0], 'out_carat'] = 1
+
+
+        imputed['out_clarity'] = 0
+
+        for val in enumerate(imputed.loc[ : , 'clarity']):
+
+            if val[1] < pipeline.clarity_limit_lo:
+                imputed.loc[val[0], 'out_clarity'] = 1
+
+        for val in enumerate(imputed.loc[ : , 'clarity']):
+
+            if val[1] > pipeline.clarity_limit_hi:
+                imputed.loc[val[0], 'out_clarity'] = 1
+
+
+        imputed['out_color'] = 0
+
+        for val in enumerate(imputed.loc[ : , 'color']):
+
+            if val[1] > pipeline.color_limit_hi:
+                imputed.loc[val[0], 'out_color'] = 1
+
+
+        imputed['out_cut'] = 0
+
+        for val in enumerate(imputed.loc[ : , 'cut']):
+
+            if val[1] == 1:
+                imputed.loc[val[0], 'out_cut'] = 1
+
+
+        imputed['out_sum'] = (imputed['out_price']   +
+                              imputed['out_carat']   +
+                              imputed['out_clarity'] +
+                              imputed['out_color']   +
+                              imputed['out_cut'])
+
+    return run
+
+
+
+def _bench_corr(flagged):
+
+    return lambda: flagged.corr()
+
+
+
+def _bench_pairplot(flagged):
+
+    import matplotlib
+
+    matplotlib.use('Agg')
+
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    def run():
+
+        sns.pairplot(data = flagged,
+                     vars = ['price', 'carat', 'color', 'clarity', 'cut'],
+                     hue = 'channel')
+
+        plt.close('all')
+
+    return run
+
+
+
+def _bench_ols(imputed):
+
+    import statsmodels.formula.api as smf
+
+    return lambda: smf.ols(formula = 'price ~ carat', data = imputed).fit()
+
+
+
+def _bench_ols_full(explored):
+
+    def run():
+
+        import statsmodels.formula.api as smf
+
+        smf.ols(formula = """
+                price ~
+                carat +
+                clarity +
+                color +
+                cut +
+                C(channel) +
+                C(store) +
+                out_price +
+                out_carat +
+                out_clarity +
+                out_cut
+                """, data = explored).fit()
+
+    return run
+
+
+
+# name: (setup function, input it needs, largest size it is run at)
+benchmarks = {'impute'     : (_bench_impute,     'raw',      None),
+              'flag'       : (_bench_flag,       'imputed',  None),
+              'flag_loops' : (_bench_flag_loops, 'imputed',  10000),
+              'corr'       : (_bench_corr,       'flagged',  None),
+              'pairplot'   : (_bench_pairplot,   'flagged',  100000),
+              'ols'        : (_bench_ols,        'imputed',  None),
+              'ols_full'   : (_bench_ols_full,   'explored', None)}
+
+
+
+###############################################################################
+# Running the benchmarks
+###############################################################################
+
+def _peak_rss_mb():
+    """Returns the peak resident memory of this process in MB."""
+
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+
+def prepare_case(name, rows, path, seed = 0):
+    """Builds the input of one benchmark at one size and saves it to path
+    (meant to run in its own process)."""
+
+    _, needs, _ = benchmarks[name]
+
+    inputs[needs](make_rows(rows, seed)).to_pickle(path)
+
+
+
+def run_case(name, rows, path, repeat = 1):
+    """Times one benchmark at one size on the input saved by prepare_case
+    (meant to run in its own, fresh process).
+
+    The process only loads the input and runs the step, so peak_rss_mb is
+    the memory of the step plus its input; input_rss_mb is the memory once
+    the input is loaded.
+    """
+
+    setup, _, _ = benchmarks[name]
+
+    run = setup(pd.read_pickle(path))
+
+    input_rss = _peak_rss_mb()
+
+    times = []
+
+    for _ in range(repeat):
+
+        start = time.perf_counter()
+
+        run()
+
+        times.append(time.perf_counter() - start)
+
+
+    seconds = min(times)
+
+    return {'stage'       : name,
+            'rows'        : rows,
+            'seconds'     : seconds,
+            'rows_per_s'  : rows / seconds if seconds else None,
+            'input_rss_mb': input_rss,
+            'peak_rss_mb' : _peak_rss_mb(),
+            'repeat'      : repeat,
+            'status'      : 'ok'}
+
+
+
+def _run_in_processes(name, rows, repeat):
+    """Prepares the input of a case in one process and times the case in
+    a fresh one."""
+
+    with tempfile.TemporaryDirectory() as folder:
+
+        path = os.path.join(folder, 'input.pkl')
+
+        with ProcessPoolExecutor(max_workers = 1) as pool:
+            pool.submit(prepare_case, name, rows, path).result()
+
+        with ProcessPoolExecutor(max_workers = 1) as pool:
+            return pool.submit(run_case, name, rows, path, repeat).result()
+
+
+
+def run_benchmarks(sizes = (10000, 1000000, 10000000), stages = None,
+                   repeat = 1, output = 'bench_results.json',
+                   limits = True):
+    """Runs every benchmark at every size and writes the results as JSON.
+
+    Each case runs in a fresh process that only loads its prepared input,
+    so that its peak memory is measured on its own. Cases above a benchmark's size limit (the row-by-row loop
+    and the pairplot take minutes to hours past it) are recorded as skipped
+    unless limits = False. Cases that fail are recorded with status
+    'error' and the run continues.
+    """
+
+    results = []
+
+    for name in stages or benchmarks:
+
+        for rows in sizes:
+
+            limit = benchmarks[name][2]
+
+            if limits and limit is not None and rows > limit:
+
+                results.append({'stage' : name, 'rows' : rows,
+                                'status' : 'skipped'})
+                continue
+
+
+            # a case that fails (MemoryError, a worker killed for running
+            # out of memory, ...) is recorded and the run goes on, so the
+            # other results are still saved
+            try:
+                result = _run_in_processes(name, rows, repeat)
+
+            except Exception as error:
+
+                results.append({'stage'  : name,
+                                'rows'   : rows,
+                                'status' : 'error',
+                                'error'  : repr(error)})
+
+                print(f"{name:<12} {rows:>10,} rows failed: {error!r}")
+                continue
+
+
+            results.append(result)
+
+            print(f"{name:<12} {rows:>10,} rows {result['seconds']:10.3f} s"
+                  f" {result['peak_rss_mb']:10.1f} MB")
+
+
+    report = {'python'  : platform.python_version(),
+              'pandas'  : pd.__version__,
+              'numpy'   : np.__version__,
+              'machine' : platform.machine(),
+              'time'    : time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'results' : results}
+
+    with open(output, 'w') as handle:
+        json.dump(report, handle, indent = 1)
+
+    return report
+
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description = __doc__)
+
+    parser.add_argument('--sizes', type = int, nargs = '+',
+                        default = [10000, 1000000, 10000000])
+
+    parser.add_argument('--stages', nargs = '+', choices = list(benchmarks))
+
+    parser.add_argument('--repeat', type = int, default = 1)
+
+    parser.add_argument('--output', default = 'bench_results.json')
+
+    parser.add_argument('--no-limits', action = 'store_true',
+                        help = 'also run the slow steps at every size')
+
+    args = parser.parse_args()
+
+    run_benchmarks(args.sizes, args.stages, args.repeat, args.output,
+                   limits = not args.no_limits)
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+
+@author: ArthurFMendes
+
+Purpose:
+    This code is meant to keep the results of each stage on disk so that a
+    stage whose data, settings and code have not changed is not run again.
+"""
+
+###############################################################################
+# Importing libraries
+###############################################################################
+
+import glob
+import hashlib
+import inspect
+import os
+import pickle
+
+import pandas as pd # data science essentials (hash_pandas_object)
+
+
+
+###############################################################################
+# Cache keys
+###############################################################################
+
+def hash_frame(diamonds):
+    """Returns a hash of the values, columns and types of a DataFrame."""
+
+    digest = hashlib.sha256()
+
+    digest.update(repr(list(diamonds.columns)).encode())
+    digest.update(repr([str(t) for t in diamonds.dtypes]).encode())
+    digest.update(pd.util.hash_pandas_object(diamonds, index = True)
+                    .to_numpy()
+                    .tobytes())
+
+    return digest.hexdigest()
+
+
+
+def code_version(directory):
+    """Returns a hash of the source of every diamond_*.py module in a
+    directory.
+
+    Most of the work of a stage is done by helper modules (diamond_impute,
+    diamond_outliers, ...), so a change to any of them must change the
+    cache key, not only a change to the stage function itself.
+    """
+
+    digest = hashlib.sha256()
+
+    for module in sorted(glob.glob(os.path.join(directory, 'diamond_*.py'))):
+
+        digest.update(os.path.basename(module).encode())
+
+        with open(module, 'rb') as handle:
+            digest.update(handle.read())
+
+    return digest.hexdigest()
+
+
+
+def stage_key(name, stage, diamonds, params = None):
+    """Builds the cache key from the input data, settings and code."""
+
+    directory = os.path.dirname(os.path.abspath(inspect.getsourcefile(stage)))
+
+    digest = hashlib.sha256()
+
+    digest.update(name.encode())
+    digest.update(hash_frame(diamonds).encode())
+    digest.update(repr(sorted((params or {}).items())).encode())
+    digest.update(inspect.getsource(stage).encode())
+    digest.update(code_version(directory).encode())
+
+    return digest.hexdigest()
+
+
+
+###############################################################################
+# Stage cache
+###############################################################################
+
+class StageCache:
+    """Stores stage results on disk, evicting the least recently used ones
+    once the cache grows past max_bytes."""
+
+    def __init__(self, directory = '.diamond_cache', max_bytes = 500e6):
+
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        os.makedirs(directory, exist_ok = True)
+
+
+
+    def _path(self, key):
+
+        return os.path.join(self.directory, key + '.pkl')
+
+
+
+    def run(self, name, stage, diamonds, params = None):
+        """Returns (output, extras) for a stage, running it on a miss.
+
+        extras holds whatever the stage added to the pipeline report
+        (correlation matrix, fitted models, ...).
+        """
+
+        path = self._path(stage_key(name, stage, diamonds, params))
+
+        try:
+            with open(path, 'rb') as handle:
+                result = pickle.load(handle)
+
+        except FileNotFoundError:
+            pass
+
+        # an entry cut short (by an interrupted run, say) is removed and
+        # computed again instead of failing every later run
+        except Exception:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+        else:
+            self.hits += 1
+
+            # touching the file marks it as recently used (unless another
+            # run has just evicted it)
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                pass
+
+            return result
+
+
+        self.misses += 1
+
+        extras = {}
+
+        result = (stage(diamonds, extras), extras)
+
+        # written under another name first, so that an interrupted or
+        # parallel run never leaves a half-written entry behind
+        partial = f'{path}.{os.getpid()}.tmp'
+
+        with open(partial, 'wb') as handle:
+            pickle.dump(result, handle, protocol = pickle.HIGHEST_PROTOCOL)
+
+        os.replace(partial, path)
+
+        self.evict()
+
+        return result
+
+
+
+    def evict(self):
+        """Removes the oldest entries until the cache fits in max_bytes."""
+
+        entries = []
+
+        for entry in os.scandir(self.directory):
+
+            if entry.name.endswith('.pkl'):
+                info = entry.stat()
+                entries.append((info.st_mtime, info.st_size, entry.path))
+
+
+        total = sum(size for _, size, _ in entries)
+
+        for _, size, path in sorted(entries):
+
+            if total <= self.max_bytes:
+                break
+
+            os.remove(path)
+
+            total -= size
+            self.evictions += 1
+
+
+
+    def size(self):
+        """Returns the number of bytes currently used by the cache."""
+
+        return sum(entry.stat().st_size
+                   for entry in os.scandir(self.directory)
+                   if entry.name.endswith('.pkl'))
+
+
+
+    def stats(self):
+        """Returns the hit and miss counts as a dictionary."""
+
+        lookups = self.hits + self.misses
+
+        return {'hits'      : self.hits,
+                'misses'    : self.misses,
+                'hit_ratio' : self.hits / lookups if lookups else 0.0,
+                'evictions' : self.evictions,
+                'bytes'     : self.size()}
+
+
+
+    def report(self):
+        """Returns the cache statistics as printable text."""
+
+        stats = self.stats()
+
+        return (f"Cache {self.directory}: {stats['hits']} hits, "
+                f"{stats['misses']} misses "
+                f"({stats['hit_ratio']:.0%} hit ratio), "
+                f"{stats['evictions']} evictions, "
+                f"{stats['bytes'] / 1e6:.1f} MB used")
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+
+@author: ArthurFMendes
+
+Purpose:
+    This code is meant to describe the saved figures of stages 6 through 9
+    as figure specs, so that they can all be rendered at once in parallel
+    (see diamond_plots.render_figures).
+"""
+
+###############################################################################
+# Importing libraries
+###############################################################################
+
+from diamond_pipeline import (price_limit_hi, carat_limit_0, carat_limit_1,
+                              carat_limit_2, color_limit_hi, clarity_limit_lo,
+                              clarity_limit_hi)
+from diamond_plots import render_figures
+
+
+
+###############################################################################
+# Shared panel settings
+###############################################################################
+
+def _hist(col, color, bins, label, kde = True, **extra):
+    """A histogram panel, as drawn by sns.distplot in the scripts (from
+    cached bin counts, see diamond_histograms)."""
+
+    kwargs = {'x' : col, 'bins' : bins, 'color' : color, 'kde' : kde}
+
+    if kde:
+        kwargs['stat'] = 'density'
+
+    return dict({'func' : 'counts.histplot', 'kwargs' : kwargs,
+                 'xlabel' : label}, **extra)
+
+
+
+def _lmplot(**extra):
+    """A carat vs. price scatter panel coloured by store."""
+
+    return dict({'func' : 'sns.lmplot',
+                 'kwargs' : {'x' : 'carat',
+                             'y' : 'price',
+                             'fit_reg' : False,
+                             'hue' : 'store',
+                             'scatter_kws' : {'marker' : 'D', 's' : 30},
+                             'palette' : 'plasma'}}, **extra)
+
+
+
+def _dashed(x, **extra):
+    """A dashed vertical line at an outlier threshold."""
+
+    return dict({'x' : x, 'linestyle' : '--'}, **extra)
+
+
+
+###############################################################################
+# Stage 6 - Imputation
+###############################################################################
+
+def _imputation_grid(alpha):
+    """The 2 x 2 grid of carat, color, clarity and cut histograms."""
+
+    return [{'subplot' : (2, 2, 1),
+             'func'    : 'counts.hist',
+             'kwargs'  : {'x' : 'carat', 'bins' : 25, 'color' : 'blue',
+                          'alpha' : alpha[0]},
+             'title'   : 'Carat Weight'},
+
+            {'subplot' : (2, 2, 2),
+             'func'    : 'counts.hist',
+             'kwargs'  : {'x' : 'color', 'bins' : 20, 'color' : 'green',
+                          'alpha' : alpha[1]},
+             'title'   : 'Color'},
+
+            {'subplot' : (2, 2, 3),
+             'func'    : 'counts.hist',
+             'kwargs'  : {'x' : 'clarity', 'bins' : 20, 'color' : 'red',
+                          'alpha' : alpha[1]},
+             'xlabel'  : 'Clarity'},
+
+            {'subplot' : (2, 2, 4),
+             'func'    : 'counts.hist',
+             'kwargs'  : {'x' : 'cut', 'bins' : 3, 'color' : 'purple',
+                          'alpha' : alpha[2]},
+             'xlabel'  : 'Cut'}]
+
+
+
+before_imputation = _imputation_grid(alpha = (0.3, 0.3, 0.1))
+
+for panel in before_imputation:
+    panel['transform'] = 'dropna'
+
+
+stage6_figures = [
+        {'filename' : 'Histograms before Imputation.png',
+         'source'   : 'diamonds_missing_values.xlsx',
+         'panels'   : before_imputation},
+
+        {'filename' : 'Histograms after Imputation.png',
+         'source'   : 'diamonds_imputed',
+         'panels'   : _imputation_grid(alpha = (0.98, 0.8, 0.8))}]
+
+
+
+###############################################################################
+# Stage 7 - Outliers
+###############################################################################
+
+stage7_figures = [
+        {'filename' : 'Carat by Channel Boxplot.png',
+         'source'   : 'diamonds_imputed',
+         'suptitle' : '',
+         'panels'   : [{'func' : 'frame.boxplot',
+                        'kwargs' : {'column' : ['carat'],
+                                    'by' : 'channel',
+                                    'vert' : False,
+                                    'patch_artist' : True,
+                                    'meanline' : True,
+                                    'showmeans' : True}}]},
+
+        {'filename' : 'Diamond Data Histograms 1 of 3.png',
+         'source'   : 'diamonds_imputed',
+         'panels'   : [_hist('price', 'g', 'fd', 'Price', subplot = (2, 2, 1)),
+                       _hist('carat', 'y', 'fd', 'Carat', subplot = (2, 2, 2)),
+                       _hist('color', 'orange', 17, 'Color', kde = False,
+                             subplot = (2, 2, 3)),
+                       _hist('clarity', 'r', 17, 'Clarity', kde = False,
+                             subplot = (2, 2, 4))]},
+
+        {'filename' : 'Diamond Data Histograms 2 of 3.png',
+         'source'   : 'diamonds_imputed',
+         'panels'   : [_hist('cut', 'navy', 'auto', 'Cut', kde = False,
+                             subplot = (2, 2, 1)),
+                       _hist('store', 'maroon', 25, 'Store', kde = False,
+                             subplot = (2, 2, 2)),
+                       _hist('channel', 'gold', 8, 'Channel', kde = False,
+                             subplot = (2, 2, 3))]},
+
+        {'filename' : 'Diamond Data Histograms 3 of 3.png',
+         'source'   : 'diamonds_imputed',
+         'panels'   : [_hist('price', 'g', 35, 'Price', subplot = (2, 2, 1),
+                             axvlines = [_dashed(price_limit_hi)]),
+                       _hist('carat', 'y', 30, 'Carat', subplot = (2, 2, 2),
+                             axvlines = [
+                                 _dashed(carat_limit_0, color = 'purple'),
+                                 _dashed(carat_limit_1, color = 'red'),
+                                 _dashed(carat_limit_2, color = 'red')]),
+                       _hist('color', 'orange', 17, 'Color', kde = False,
+                             subplot = (2, 2, 3),
+                             axvlines = [_dashed(color_limit_hi)]),
+                       _hist('clarity', 'r', 17, 'Clarity', kde = False,
+                             subplot = (2, 2, 4),
+                             axvlines = [_dashed(clarity_limit_lo),
+                                         _dashed(clarity_limit_hi)])]}]
+
+
+
+###############################################################################
+# Stage 8 - Exploratory data analysis
+###############################################################################
+
+price_vars = ['price', 'carat', 'color', 'clarity', 'cut']
+
+
+stage8_figures = [
+        {'filename' : 'Diamond Correlation Heatmap.png',
+         'source'   : 'diamonds_flagged',
+         'panels'   : [{'func' : 'sns.heatmap', 'transform' : 'corr',
+                        'kwargs' : {'cmap' : 'Blues',
+                                    'square' : True,
+                                    'annot' : False,
+                                    'linecolor' : 'black',
+                                    'linewidths' : 0.5}}]},
+
+        {'filename' : 'Diamond Correlation Heatmap 2.png',
+         'source'   : 'diamonds_flagged',
+         'figsize'  : (15, 15),
+         'panels'   : [{'func' : 'sns.heatmap', 'transform' : 'corr',
+                        'kwargs' : {'cmap' : 'coolwarm',
+                                    'square' : True,
+                                    'annot' : True,
+                                    'linecolor' : 'black',
+                                    'linewidths' : 0.5}}]},
+
+        {'filename' : 'Diamond Data Scatterplots.png',
+         'source'   : 'diamonds_flagged',
+         'panels'   : [{'subplot' : (2, 2, position),
+                        'func' : 'plt.scatter',
+                        'kwargs' : {'x' : col, 'y' : 'price',
+                                    'alpha' : 0.7, 'color' : color},
+                        'title' : title}
+                       for position, col, color, title in
+                       [(1, 'carat', 'red', 'Carat Weight'),
+                        (2, 'color', 'blue', 'Color'),
+                        (3, 'clarity', 'magenta', 'Clarity'),
+                        (4, 'cut', 'brown', 'Cut')]]},
+
+        {'filename' : 'Diamond Data Pairplot.png',
+         'source'   : 'diamonds_flagged',
+         'panels'   : [{'func' : 'sns.pairplot',
+                        'kwargs' : {'x_vars' : price_vars,
+                                    'y_vars' : price_vars,
+                                    'hue' : 'channel',
+                                    'palette' : 'plasma'}}]},
+
+        {'filename' : 'Diamond Price Pairplot.png',
+         'source'   : 'diamonds_flagged',
+         'panels'   : [{'func' : 'sns.pairplot',
+                        'kwargs' : {'x_vars' : price_vars[1:],
+                                    'y_vars' : ['price'],
+                                    'hue' : 'channel',
+                                    'palette' : 'plasma'}}]},
+
+        {'filename' : 'Price and Carat by Store.png',
+         'source'   : 'diamonds_explored',
+         'panels'   : [_lmplot(title = 'Price and Carat by Store')]}]
+
+
+for channel, title in [('mall', 'Shopping Malls'),
+                       ('independent', 'Independent'),
+                       ('online', 'Online')]:
+
+    stage8_figures.append(
+        {'filename' : f'Price and Carat {title}.png',
+         'source'   : 'diamonds_explored',
+         'panels'   : [_lmplot(query = f"channel == '{channel}'",
+                               title = title)]})
+
+    stage8_figures.append(
+        {'filename' : f'Price by Store Violin {title}.png',
+         'source'   : 'diamonds_explored',
+         'panels'   : [{'func' : 'sns.violinplot',
+                        'query' : f"channel == '{channel}'",
+                        'kwargs' : {'x' : 'store', 'y' : 'price',
+                                    'orient' : 'v'}}]})
+
+
+
+###############################################################################
+# Stage 9 - Regression
+###############################################################################
+
+stage9_figures = [
+        {'filename' : 'Price ~ Carat|Channel Regression.png',
+         'source'   : 'diamonds_explored',
+         'panels'   : [{'func' : 'sns.lmplot',
+                        'kwargs' : {'x' : 'carat', 'y' : 'price',
+                                    'hue' : 'channel',
+                                    'col' : 'channel',
+                                    'col_wrap' : 2,
+                                    'scatter_kws' : {'marker' : 'D', 's' : 10},
+                                    'palette' : 'nipy_spectral'}}]},
+
+        {'filename' : 'Price ~ Carat by Channel and Store.png',
+         'source'   : 'diamonds_explored',
+         'panels'   : [{'func' : 'sns.lmplot',
+                        'kwargs' : {'x' : 'carat', 'y' : 'price',
+                                    'hue' : 'store',
+                                    'col' : 'channel',
+                                    'col_wrap' : 2,
+                                    'scatter_kws' : {'marker' : 'D', 's' : 10},
+                                    'palette' : 'nipy_spectral'}}]},
+
+        {'filename' : 'Price ~ Carat Jointplot.png',
+         'source'   : 'diamonds_explored',
+         'panels'   : [{'func' : 'sns.jointplot',
+                        'kwargs' : {'x' : 'carat', 'y' : 'price',
+                                    'kind' : 'reg',
+                                    'joint_kws' : {'color' : 'blue'}}}]},
+
+        {'filename' : 'Price ~ Carat Redidual Plot.png',
+         'source'   : 'diamonds_explored',
+         'panels'   : [{'func' : 'sns.residplot',
+                        'kwargs' : {'x' : 'carat', 'y' : 'price',
+                                    'lowess' : True,
+                                    'color' : 'r',
+                                    'line_kws' : {'color' : 'black'}}}]}]
+
+
+
+all_figures = stage6_figures + stage7_figures + stage8_figures + stage9_figures
+
+
+
+if __name__ == '__main__':
+
+    # The stage files must exist, e.g. after diamond_pipeline.py has run
+    for filename in render_figures(all_figures):
+        print(filename)
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+
+@author: ArthurFMendes
+
+Purpose:
+    This code is meant to count the values of a column in histogram bins
+    once, keep the counts, and draw the saved histogram figures of stages 6
+    and 7 (the 'counts.*' panels of diamond_figures) from them, so that
+    redrawing a histogram does not depend on the number of rows. The
+    exploratory plt.hist and sns.distplot calls in the stage scripts still
+    draw from the rows.
+"""
+
+###############################################################################
+# Importing libraries
+###############################################################################
+
+import os
+
+import numpy as np # fast arrays (histogram, bin edges)
+
+from diamond_io import STORE_META, column_store_path, load_columns
+
+
+
+###############################################################################
+# Bin counts
+###############################################################################
+
+class BinCounts:
+    """The bin edges of a histogram and the number of values in each bin.
+
+    Counts of different batches with the same edges can be merged, so a
+    histogram of a large file can be built one batch at a time.
+    """
+
+    def __init__(self, edges, counts):
+
+        self.edges = np.asarray(edges, dtype = float)
+        self.counts = np.asarray(counts, dtype = 'int64')
+
+
+
+    def merge(self, other):
+        """Adds the counts of another BinCounts with the same edges."""
+
+        if not np.array_equal(self.edges, other.edges):
+            raise ValueError('Bin counts with different edges cannot be '
+                             'merged.')
+
+        self.counts = self.counts + other.counts
+
+        return self
+
+
+
+    def total(self):
+
+        return int(self.counts.sum())
+
+
+
+    def centres(self):
+        """Returns the middle of every bin."""
+
+        return (self.edges[:-1] + self.edges[1:]) / 2
+
+
+
+def bin_counts(values, bins = 10, range = None):
+    """Counts the values of an array or Series in bins (missing values are
+    left out).
+
+    bins takes anything np.histogram does: a number of bins, a rule such
+    as 'auto' or 'fd', or the bin edges themselves.
+    """
+
+    values = np.asarray(values, dtype = float)
+
+    values = values[~np.isnan(values)]
+
+    edges = np.histogram_bin_edges(values, bins, range)
+
+    counts, _ = np.histogram(values, edges)
+
+    return BinCounts(edges, counts)
+
+
+
+def batch_bin_counts(batches, col, edges):
+    """Counts one column over a stream of batches, with fixed bin edges
+    (for example np.linspace over the min and max of a RunningSummary)."""
+
+    total = BinCounts(edges, np.zeros(len(edges) - 1))
+
+    for batch in batches:
+        total.merge(bin_counts(batch[col], edges))
+
+    return total
+
+
+
+###############################################################################
+# Cached counts of stage files
+###############################################################################
+
+"""
+    The counts of a stage file are saved in its column store folder (one
+    small .npz per column and bin setting) and kept in memory once loaded.
+    They are counted again only when the column store is rebuilt, that is
+    when the stage file changes.
+"""
+
+_bin_counts_cache = {}
+
+
+
+def _counts_path(source, col, bins, dropna):
+    """Returns the file the counts of one column are saved in."""
+
+    name = f'hist_{col}_{bins}' + ('_dropna' if dropna else '') + '.npz'
+
+    return os.path.join(column_store_path(source), name)
+
+
+
+def source_bin_counts(source, col, bins = 10, dropna = False):
+    """Returns the bin counts of a column of a stage file or workbook.
+
+    With dropna = True only complete rows are counted, as after
+    diamonds.dropna() in the "before imputation" histograms.
+    """
+
+    # builds the column store, or rebuilds it if the stage file changed
+    load_columns(source, columns = [])
+
+    built = os.path.getmtime(os.path.join(column_store_path(source),
+                                          STORE_META))
+
+    key = (source, col, str(bins), dropna, built)
+
+    if key in _bin_counts_cache:
+        return _bin_counts_cache[key]
+
+
+    path = _counts_path(source, col, bins, dropna)
+
+    if os.path.exists(path) and os.path.getmtime(path) >= built:
+
+        with np.load(path) as saved:
+            counts = BinCounts(saved['edges'], saved['counts'])
+
+    else:
+
+        diamonds = load_columns(source)
+
+        if dropna:
+            values = diamonds.dropna()[col]
+        else:
+            values = diamonds[col]
+
+        counts = bin_counts(values, bins)
+
+        # written under another name first, so that figures rendered in
+        # parallel never read a half-written file
+        partial = f'{path}.{os.getpid()}.npz'
+
+        np.savez(partial, edges = counts.edges, counts = counts.counts)
+
+        os.replace(partial, path)
+
+
+    _bin_counts_cache[key] = counts
+
+    return counts
+
+
+
+###############################################################################
+# Drawing from counts
+###############################################################################
+
+def hist(source, x, bins = 10, dropna = False, **kwargs):
+    """Draws plt.hist from the cached counts of a column."""
+
+    from diamond_plots import plt
+
+    counts = source_bin_counts(source, x, bins, dropna)
+
+    # one weighted value per bin gives the same bars as the raw values
+    return plt.hist(counts.centres(), counts.edges,
+                    weights = counts.counts, **kwargs)
+
+
+
+def histplot(source, x, bins = 'auto', dropna = False, **kwargs):
+    """Draws sns.histplot from the cached counts of a column.
+
+    The kde, if asked for, is estimated from the bin centres (weighted by
+    their counts) instead of from every value.
+    """
+
+    import pandas as pd
+
+    from diamond_plots import sns
+
+    counts = source_bin_counts(source, x, bins, dropna)
+
+    bars = pd.DataFrame({x : counts.centres(), 'count' : counts.counts})
+
+    return sns.histplot(data = bars, x = x, weights = 'count',
+                        bins = counts.edges.tolist(), **kwargs)
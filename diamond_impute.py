@@ -0,0 +1,776 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+
+@author: ArthurFMendes
+
+Purpose:
+    This code is meant to compare imputation strategies (mean, median and
+    dropping incomplete rows) on the diamond dataset without copying it, to
+    impute from the diamonds of the same channel and store (group
+    statistics, nearest neighbours or chained equations), and to keep
+    fitted fill values for imputing new batches.
+"""
+
+###############################################################################
+# Importing libraries
+###############################################################################
+
+import numpy as np # fast arrays (nan handling, median)
+import pandas as pd # data science essentials (DataFrame, Series)
+
+
+
+###############################################################################
+# Strategy statistics
+###############################################################################
+
+def strategy_stats(diamonds):
+    """Computes what every imputation strategy needs in one scan.
+
+    For each column with missing values this returns the positions of the
+    missing values, the mean and the median of the values present. It also
+    returns keep, a boolean array that is False for every row with a
+    missing value (the rows dropna() would remove).
+    """
+
+    stats = {}
+
+    keep = np.ones(len(diamonds), dtype = bool)
+
+
+    for col in diamonds.columns:
+
+        values = diamonds[col]
+
+        # integer and boolean columns cannot hold missing values
+        if values.dtype.kind in 'iub':
+            continue
+
+        array = values.to_numpy(dtype = float, na_value = np.nan)
+
+        nulls = np.isnan(array)
+
+        if not nulls.any():
+            continue
+
+
+        present = array[~nulls]
+
+        stats[col] = {'missing' : np.flatnonzero(nulls),
+                      'count'   : len(present),
+                      'sum'     : present.sum(),
+                      'mean'    : present.mean(),
+                      'median'  : np.median(present)}
+
+        keep &= ~nulls
+
+
+    return stats, keep
+
+
+
+###############################################################################
+# Strategy views
+###############################################################################
+
+class StrategyView:
+    """One imputation strategy applied on top of a dataset.
+
+    The view keeps references to the original columns and stores only the
+    filled cells (fills) or the rows to keep (keep); a column is only
+    built when it is asked for, so a strategy costs memory in proportion to
+    the number of missing values, not to the size of the dataset.
+    """
+
+    def __init__(self, diamonds, fills = None, keep = None, decimals = None):
+
+        # references to the current columns, not copies; later changes to
+        # diamonds do not show up in the view
+        self._columns = {col : diamonds[col] for col in diamonds.columns}
+
+        self._fills = fills or {}
+        self._keep = keep
+
+        # stage 6 rounds every filled column (fillna(...).round(2)) and, for
+        # df_dropped, every column (dropna().round(2))
+        self._decimals = decimals
+
+
+
+    def _rounds(self, col):
+        """Checks whether a column is rounded under this strategy."""
+
+        if self._decimals is None:
+            return False
+
+        # whole numbers are left as they are
+        if self._columns[col].dtype.kind not in 'fc':
+            return False
+
+        return col in self._fills or self._keep is not None
+
+
+
+    @property
+    def columns(self):
+
+        return list(self._columns)
+
+
+
+    def __len__(self):
+
+        if self._keep is None:
+            return len(next(iter(self._columns.values())))
+
+        return int(self._keep.sum())
+
+
+
+    def __getitem__(self, col):
+        """Returns one column with the strategy applied."""
+
+        values = self._columns[col]
+
+        if col in self._fills:
+
+            positions, fill = self._fills[col]
+
+            array = values.to_numpy(dtype = float, copy = True)
+
+            array[positions] = fill
+
+            values = pd.Series(array, index = values.index, name = col)
+
+
+        if self._keep is not None:
+            values = values[self._keep]
+
+        if self._rounds(col):
+            values = values.round(self._decimals)
+
+        return values
+
+
+
+    def mean(self):
+        """Returns the mean of every column without building the columns."""
+
+        means = {}
+
+        for col, values in self._columns.items():
+
+            if not pd.api.types.is_numeric_dtype(values.dtype):
+                continue
+
+            if self._keep is not None:
+                values = values[self._keep]
+
+                if self._rounds(col):
+                    values = values.round(self._decimals)
+
+                means[col] = values.mean()
+
+            elif col in self._fills:
+                positions, fill = self._fills[col]
+
+                if self._rounds(col):
+                    values = values.round(self._decimals)
+
+                means[col] = ((values.sum() + len(positions) * fill) /
+                              len(values))
+
+            else:
+                means[col] = values.mean()
+
+
+        return pd.Series(means)
+
+
+
+    def has_missing(self):
+        """Checks whether any value is still missing under this strategy."""
+
+        for col, values in self._columns.items():
+
+            if col in self._fills:
+                continue
+
+            nulls = values.isnull().to_numpy()
+
+            if self._keep is not None:
+                nulls = nulls[self._keep]
+
+            if nulls.any():
+                return True
+
+
+        return False
+
+
+
+    def to_frame(self):
+        """Builds the full DataFrame (this is where the copy is made)."""
+
+        return pd.DataFrame({col : self[col] for col in self._columns})
+
+
+
+def impute_strategies(diamonds, decimals = 2):
+    """Returns the mean, median and dropped strategies as views.
+
+    As in stage 6, the filled columns of the mean and median strategies and
+    every column of the dropped strategy are rounded to decimals places.
+    All strategies share one scan of the data (see strategy_stats), so
+    adding a strategy costs about nothing.
+    """
+
+    stats, keep = strategy_stats(diamonds)
+
+    views = {}
+
+    for strategy in ['mean', 'median']:
+
+        fills = {col : (col_stats['missing'],
+                        round(col_stats[strategy], decimals))
+                 for col, col_stats in stats.items()}
+
+        views[strategy] = StrategyView(diamonds, fills = fills,
+                                       decimals = decimals)
+
+
+    views['dropped'] = StrategyView(diamonds, keep = keep,
+                                    decimals = decimals)
+
+    return views
+
+
+
+###############################################################################
+# Imputing by channel and store
+###############################################################################
+
+"""
+    Prices and carats differ a lot between channels and stores (see the
+    lmplots in stage 8), so missing values can be filled from the diamonds
+    of the same channel and store instead of the whole dataset. Groups with
+    fewer than min_count known values fall back to the overall value.
+"""
+
+# column: (statistic, rounding), as chosen in stage 6. Rounding is a number
+# of decimals, or 'trunc' for clarity's .astype(int). The medians of the
+# color and cut codes are rounded so that they stay whole codes.
+GROUP_RULES = {'carat'   : ('median', 2),
+               'color'   : ('median', 0),
+               'clarity' : ('mean', 'trunc'),
+               'cut'     : ('median', 0)}
+
+
+GROUP_KEYS = ['channel', 'store']
+
+
+
+def _round(values, rounding):
+    """Applies a rounding rule to a number or an array."""
+
+    if rounding is None:
+        return values
+
+    if rounding == 'trunc':
+        return np.trunc(values)
+
+    return np.round(values, rounding)
+
+
+
+class GroupFills:
+    """Fill values per group (a small lookup table) plus overall values.
+
+    Build it with group_fills(); fill() imputes any number of rows with one
+    vectorized lookup per column. The table can be saved and loaded again
+    with save() and GroupFills.load().
+    """
+
+    def __init__(self, table, overall, rules = GROUP_RULES, by = GROUP_KEYS):
+
+        self.table = table
+        self.overall = overall
+        self.rules = rules
+        self.by = list(by)
+
+
+
+    def fill(self, diamonds):
+        """Returns a copy of diamonds with the missing values filled."""
+
+        diamonds = diamonds.copy()
+
+        if len(self.by) == 1:
+            keys = pd.Index(diamonds[self.by[0]])
+        else:
+            keys = pd.MultiIndex.from_frame(diamonds[self.by])
+
+        # row of the lookup table for every diamond (-1 if the group is new)
+        positions = self.table.index.get_indexer(keys)
+
+        known = positions >= 0
+
+
+        for col in self.rules:
+
+            values = diamonds[col].to_numpy(dtype = float)
+
+            nulls = np.isnan(values)
+
+            if not nulls.any():
+                continue
+
+            fills = np.where(known,
+                             self.table[col].to_numpy()[positions],
+                             self.overall[col])
+
+            diamonds[col] = np.where(nulls, fills, values)
+
+
+        return diamonds
+
+
+
+    def save(self, name):
+        """Saves the lookup table (with the overall values) to parquet."""
+
+        from diamond_io import stage_path
+
+        table = self.table.reset_index()
+
+        overall = pd.DataFrame([self.overall])
+
+        for col in self.by:
+            overall[col] = -1
+
+        pd.concat([table, overall], ignore_index = True).to_parquet(
+                stage_path(name), index = False)
+
+
+
+    @classmethod
+    def load(cls, name, rules = GROUP_RULES, by = GROUP_KEYS):
+        """Loads a lookup table written by save()."""
+
+        from diamond_io import stage_path
+
+        table = pd.read_parquet(stage_path(name))
+
+        is_overall = (table[list(by)] == -1).all(axis = 1)
+
+        overall = table.loc[is_overall, list(rules)].iloc[0]
+
+        table = table.loc[~is_overall].astype({col : 'int64' for col in by})
+
+        return cls(table.set_index(list(by)), overall, rules, by)
+
+
+
+def group_fills(diamonds, rules = GROUP_RULES, by = GROUP_KEYS,
+                min_count = 10):
+    """Computes the fill value of every group in one grouped aggregation.
+
+    Keep the returned GroupFills (or save it) to fill more rows or new
+    batches without computing the table again.
+    """
+
+    aggregations = {}
+
+    for col, (statistic, _) in rules.items():
+        aggregations[col] = (col, statistic)
+        aggregations['n_'+col] = (col, 'count')
+
+    grouped = diamonds.groupby(list(by), observed = True).agg(**aggregations)
+
+
+    overall = {}
+
+    table = pd.DataFrame(index = grouped.index)
+
+    for col, (statistic, rounding) in rules.items():
+
+        overall[col] = _round(getattr(diamonds[col], statistic)(), rounding)
+
+        small = grouped['n_'+col] < min_count
+
+        table[col] = _round(grouped[col].where(~small, np.nan), rounding)
+
+        table[col] = table[col].fillna(overall[col])
+
+
+    return GroupFills(table, pd.Series(overall), rules, by)
+
+
+
+###############################################################################
+# Fitting once, imputing new batches
+###############################################################################
+
+"""
+    Stage 6 fills carat with its mean (rounded to 2 decimals), color and
+    cut with their median and clarity with its mean (truncated by
+    .astype(int)). fit_imputer() computes these fill values once and keeps
+    them, with the rounding rules and the column types, in a small
+    ImputationFit that can be saved as JSON. New batches are then imputed
+    with transform(), which only looks at the batch itself.
+"""
+
+# column: (statistic, rounding), as in stage 6
+STAGE6_RULES = {'carat'   : ('mean', 2),
+                'color'   : ('median', None),
+                'clarity' : ('mean', 'trunc'),
+                'cut'     : ('median', None)}
+
+
+# type of each column after imputation (clarity becomes an integer)
+STAGE6_SCHEMA = {'carat'   : 'float64',
+                 'color'   : 'float64',
+                 'clarity' : 'int64',
+                 'cut'     : 'float64'}
+
+
+
+class ImputationFit:
+    """Fill values, rounding rules and column types learned by fit_imputer.
+
+    transform() fills a batch with one vectorized pass per column; save()
+    and ImputationFit.load() keep the fit in a JSON file of a few lines.
+    """
+
+    def __init__(self, fills, rules = STAGE6_RULES, schema = STAGE6_SCHEMA):
+
+        self.fills = dict(fills)
+        self.rules = dict(rules)
+        self.schema = dict(schema)
+
+
+
+    def transform(self, diamonds, copy = True):
+        """Returns diamonds with the missing values filled and the columns
+        rounded and typed as in stage 6."""
+
+        if copy:
+            diamonds = diamonds.copy()
+
+        for col, fill in self.fills.items():
+
+            values = diamonds[col].to_numpy(dtype = float)
+
+            nulls = np.isnan(values)
+
+            if nulls.any():
+                values = np.where(nulls, fill, values)
+
+            # stage 6 rounds the whole column, not only the filled values
+            values = _round(values, self.rules.get(col, (None, None))[1])
+
+            diamonds[col] = values.astype(self.schema.get(col, 'float64'))
+
+        return diamonds
+
+
+
+    def to_dict(self):
+
+        return {'fills'  : self.fills,
+                'rules'  : {col : list(rule) for col, rule
+                            in self.rules.items()},
+                'schema' : self.schema}
+
+
+
+    def save(self, name):
+        """Saves the fit to <name>.json."""
+
+        import json
+
+        from diamond_io import stage_path
+
+        with open(stage_path(name, '.json'), 'w') as handle:
+            json.dump(self.to_dict(), handle, indent = 1)
+
+
+
+    @classmethod
+    def load(cls, name):
+        """Loads a fit written by save()."""
+
+        import json
+
+        from diamond_io import stage_path
+
+        with open(stage_path(name, '.json')) as handle:
+            saved = json.load(handle)
+
+        rules = {col : tuple(rule) for col, rule in saved['rules'].items()}
+
+        return cls(saved['fills'], rules, saved['schema'])
+
+
+
+def fit_imputer(diamonds, rules = STAGE6_RULES, schema = STAGE6_SCHEMA):
+    """Computes the fill value of every column (one scan per column)."""
+
+    fills = {col : float(_round(getattr(diamonds[col], statistic)(),
+                                rounding))
+             for col, (statistic, rounding) in rules.items()}
+
+    return ImputationFit(fills, rules, schema)
+
+
+
+###############################################################################
+# Nearest neighbour imputation
+###############################################################################
+
+"""
+    A missing value can also be filled from the k most similar complete
+    diamonds of the same channel and store, comparing the attributes that
+    are known (and price). Rows are grouped by which attributes they are
+    missing; for each group and pattern a KD-tree is built once over the
+    complete diamonds and all the rows are looked up in batches, using
+    every core. Attributes are scaled by their standard deviation so that
+    price does not outweigh the others.
+"""
+
+KNN_FEATURES = ['carat', 'color', 'clarity', 'cut', 'price']
+
+
+
+def _knn_fill(neighbours, col):
+    """Combines the neighbours' values: mean carat, median codes."""
+
+    if col == 'carat':
+        return np.round(neighbours.mean(axis = 1), 2)
+
+    return np.round(np.median(neighbours, axis = 1))
+
+
+
+def knn_impute(diamonds, k = 5, by = GROUP_KEYS, columns = None,
+               features = KNN_FEATURES, batch_size = 100000, workers = -1):
+    """Returns a copy of diamonds with missing values filled from the k
+    nearest complete diamonds of the same group (see above).
+
+    Groups with fewer than k complete diamonds use the whole dataset.
+    workers is passed to the KD-tree query (-1 uses every core).
+    """
+
+    from scipy.spatial import cKDTree
+
+    from diamond_missing import MISSING_COLUMNS, profile_missing
+
+    columns = columns or MISSING_COLUMNS
+
+    diamonds = diamonds.copy()
+
+    _, mask = profile_missing(diamonds, columns)
+
+    mask = mask.to_numpy()
+
+    values = {col : diamonds[col].to_numpy(dtype = float)
+              for col in features}
+
+    complete = mask == 0
+
+    scale = {col : np.nanstd(values[col][complete]) or 1.0
+             for col in features}
+
+
+    # one integer code per (channel, store) group
+    groups = diamonds.groupby(list(by), observed = True).ngroup().to_numpy()
+
+    filled = {col : values[col].copy() for col in columns}
+
+    trees = {}
+
+
+    for pattern in np.unique(mask[~complete]):
+
+        missing_cols = [col for i, col in enumerate(columns)
+                        if pattern >> i & 1]
+
+        known = [col for col in features if col not in missing_cols]
+
+        if not known:
+            continue
+
+        points = np.column_stack([values[col] / scale[col] for col in known])
+
+
+        in_pattern = mask == pattern
+
+        for group in np.unique(groups[in_pattern]):
+
+            donors = complete & (groups == group)
+
+            tree_group = group
+
+            if donors.sum() < k:
+                donors, tree_group = complete, -1
+
+            # trees over the whole dataset are shared between groups
+            if (pattern, tree_group) not in trees:
+                trees[pattern, tree_group] = (
+                        cKDTree(points[donors],
+                                balanced_tree = False,
+                                compact_nodes = False),
+                        np.flatnonzero(donors))
+
+            tree, donor_rows = trees[pattern, tree_group]
+
+            rows = np.flatnonzero(in_pattern & (groups == group))
+
+
+            for start in range(0, len(rows), batch_size):
+
+                batch = rows[start:start + batch_size]
+
+                _, nearest = tree.query(points[batch],
+                                        k = min(k, len(donor_rows)),
+                                        workers = workers)
+
+                nearest = donor_rows[nearest.reshape(len(batch), -1)]
+
+                for col in missing_cols:
+                    filled[col][batch] = _knn_fill(values[col][nearest], col)
+
+
+    for col in columns:
+        diamonds[col] = filled[col]
+
+    return diamonds
+
+
+
+###############################################################################
+# Chained equations (iterative model-based) imputation
+###############################################################################
+
+"""
+    Chained equations start from mean-filled columns and then, in each
+    iteration, fit one linear model per incomplete column on the other
+    attributes, price and the channel, and replace that column's missing
+    values with the model's predictions. The next iteration starts from
+    these values (a warm start). All the models of one iteration use the
+    values of the previous one, so they are fitted at the same time in a
+    pool of threads (numpy releases the GIL while it does the maths).
+    Iterations stop once the filled values change by less than tol
+    standard deviations on average.
+"""
+
+def _fit_predict(design, target, missing):
+    """Fits column target of design on the other columns and returns the
+    predictions for its missing rows."""
+
+    features = np.delete(np.arange(design.shape[1]), target)
+
+    observed = design[~missing]
+
+    # normal equations: a small (features x features) system, whatever the
+    # number of rows
+    x = observed[:, features]
+
+    coef = np.linalg.lstsq(x.T @ x, x.T @ observed[:, target],
+                           rcond = None)[0]
+
+    return design[missing][:, features] @ coef
+
+
+
+def chained_impute(diamonds, columns = None, max_iter = 10, tol = 1e-3,
+                   rules = GROUP_RULES, workers = None):
+    """Returns (diamonds with missing values filled, history).
+
+    history has one entry per iteration with its duration in seconds and
+    the average change of the filled values (in standard deviations).
+    The rounding rules of GROUP_RULES are applied at the end, and codes are
+    kept within the range seen in the data.
+    """
+
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+
+    from diamond_missing import MISSING_COLUMNS
+
+    columns = [col for col in (columns or MISSING_COLUMNS)
+               if diamonds[col].isnull().any()]
+
+    diamonds = diamonds.copy()
+
+
+    # one float matrix: the columns that are always known (intercept, price
+    # and the channel), then the columns being imputed
+    channels = diamonds['channel'].to_numpy()
+
+    known = ([np.ones(len(diamonds)), diamonds['price'].to_numpy()] +
+             [channels == channel for channel in np.unique(channels)[1:]])
+
+    design = np.column_stack(known + [diamonds[col].to_numpy(dtype = float)
+                                      for col in columns]).astype(float)
+
+    position = {col : len(known) + i for i, col in enumerate(columns)}
+
+    missing = {col : np.isnan(design[:, position[col]]) for col in columns}
+
+    spread = {col : np.nanstd(design[:, position[col]]) or 1.0
+              for col in columns}
+
+    for col in columns:
+        design[missing[col], position[col]] = np.nanmean(
+                                                design[:, position[col]])
+
+
+    history = []
+
+    with ThreadPoolExecutor(max_workers = workers) as pool:
+
+        for iteration in range(1, max_iter + 1):
+
+            start = time.perf_counter()
+
+            jobs = {col : pool.submit(_fit_predict, design, position[col],
+                                      missing[col])
+                    for col in columns}
+
+            predictions = {col : job.result() for col, job in jobs.items()}
+
+
+            change = 0.0
+
+            for col, predicted in predictions.items():
+
+                current = design[missing[col], position[col]]
+
+                change += np.abs(predicted - current).mean() / spread[col]
+
+                design[missing[col], position[col]] = predicted
+
+
+            change /= max(len(columns), 1)
+
+            history.append({'iteration' : iteration,
+                            'seconds'   : time.perf_counter() - start,
+                            'change'    : float(change)})
+
+            if change < tol:
+                break
+
+
+    for col in columns:
+
+        filled = np.clip(design[missing[col], position[col]],
+                         diamonds[col].min(), diamonds[col].max())
+
+        rounding = rules[col][1] if col in rules else None
+
+        diamonds.loc[missing[col], col] = _round(filled, rounding)
+
+
+    return diamonds, history
@@ -0,0 +1,438 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+
+@author: ArthurFMendes
+
+Purpose:
+    This code is meant to move the diamond dataset between the stages of
+    the analysis (6 through 9) using a columnar file format, to read large
+    raw workbooks in batches and to keep a memory-mapped copy of the
+    columns for fast start-up.
+"""
+
+###############################################################################
+# Importing libraries
+###############################################################################
+
+import json
+import os
+import time
+
+import numpy as np # fast arrays (save, load with mmap_mode)
+import pandas as pd # data science essentials (read_parquet, DataFrame)
+
+from diamond_missing import MISSING_MASK
+
+
+
+###############################################################################
+# Dataset schema
+###############################################################################
+
+# Column types of diamonds_missing_values.xlsx. The attributes that can be
+# missing are floats so that NaN fits in them; channel and store are small
+# codes (0-2 and 1-11).
+RAW_SCHEMA = {'Obs'     : 'int32',
+              'carat'   : 'float64',
+              'color'   : 'float32',
+              'clarity' : 'float32',
+              'cut'     : 'float32',
+              'channel' : 'uint8',
+              'store'   : 'uint8',
+              'price'   : 'int32'}
+
+
+# Ordinal codes that become int8 once they have no missing values
+CODE_COLUMNS = ['color', 'clarity', 'cut']
+
+
+# 0/1 flags (m_*, out_*) and their sum are stored in one byte
+FLAG_PREFIXES = ('m_', 'out_')
+
+
+
+def compact_schema(diamonds, carat_float32 = False):
+    """Casts the diamond columns to the smallest types that hold them.
+
+    Obs and price become int32, channel and store uint8 codes (or category
+    once they are labelled, as in stage 8), color/clarity/cut int8 when they
+    are complete whole numbers (float32 otherwise) and the m_* and out_*
+    flags uint8. carat stays float64 unless carat_float32 = True. Columns the
+    schema does not know about are left alone.
+    """
+
+    # every column is replaced whole below, so the data is never copied
+    # more than once (the caller's frame is left as it was)
+    diamonds = diamonds.copy(deep = False)
+
+    for col in diamonds.columns:
+
+        values = diamonds[col]
+
+        numeric = (pd.api.types.is_numeric_dtype(values.dtype) and
+                   not pd.api.types.is_bool_dtype(values.dtype))
+
+
+        if col in ('channel', 'store'):
+
+            if numeric:
+                diamonds[col] = values.astype('uint8')
+            else:
+                diamonds[col] = values.astype('category')
+
+
+        elif not numeric:
+            continue
+
+
+        elif col in ('Obs', 'price'):
+            diamonds[col] = values.astype('int32')
+
+
+        elif col == 'carat':
+            diamonds[col] = values.astype('float32' if carat_float32
+                                          else 'float64')
+
+
+        elif col in CODE_COLUMNS:
+
+            complete = (not values.isnull().any() and
+                        (values == values.round()).all())
+
+            diamonds[col] = values.astype('int8' if complete else 'float32')
+
+
+        # m_mask already has the smallest type with one bit per column
+        # (uint16 or more past 8 columns), so it is not cut to uint8
+        elif col == MISSING_MASK:
+            continue
+
+
+        elif str(col).startswith(FLAG_PREFIXES):
+            diamonds[col] = values.astype('uint8')
+
+
+    return diamonds
+
+
+
+###############################################################################
+# Stage files
+###############################################################################
+
+"""
+    Each stage saves its output as <name>.parquet. Parquet keeps the column
+    types and lets the next stage read only the columns it needs. A copy in
+    Excel (<name>.xlsx) can still be written for people who want to open the
+    data by hand.
+"""
+
+PARQUET_EXT = '.parquet'
+
+EXCEL_EXT = '.xlsx'
+
+
+
+def stage_path(name, ext = PARQUET_EXT):
+    """Returns the file name for a stage, with or without an extension."""
+
+    base, old_ext = os.path.splitext(name)
+
+    if old_ext in (PARQUET_EXT, EXCEL_EXT):
+        name = base
+
+    return name + ext
+
+
+
+def save_stage(diamonds, name, excel = False, carat_float32 = False):
+    """Saves a stage to parquet (in the compact schema) and, optionally,
+    to Excel."""
+
+    path = stage_path(name)
+
+    diamonds = compact_schema(diamonds, carat_float32 = carat_float32)
+
+    diamonds.to_parquet(path, index = False)
+
+    if excel:
+        diamonds.to_excel(stage_path(name, EXCEL_EXT), index = False)
+
+    return path
+
+
+
+def load_stage(name, columns = None):
+    """Loads a stage, reading only the columns asked for.
+
+    Falls back to the Excel copy when no parquet file has been written
+    yet (for example, data saved by an older version of the scripts).
+    """
+
+    path = stage_path(name)
+
+    if os.path.exists(path):
+        return pd.read_parquet(path, columns = columns)
+
+    diamonds = pd.read_excel(stage_path(name, EXCEL_EXT))
+
+    if columns is not None:
+        diamonds = diamonds.loc[:, list(columns)]
+
+    return diamonds
+
+
+
+###############################################################################
+# Reading raw workbooks in batches
+###############################################################################
+
+def iter_excel_batches(file, batch_size = 100000, schema = RAW_SCHEMA):
+    """Yields the rows of a workbook as DataFrames of batch_size rows.
+
+    The sheet is streamed with openpyxl in read-only mode, so only one batch
+    is held in memory at a time. Every batch has the same columns and types
+    (schema), even when a batch happens to have no missing values.
+    """
+
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(file, read_only = True, data_only = True)
+
+    try:
+        rows = workbook.active.iter_rows(values_only = True)
+
+        header = [str(col) for col in next(rows)]
+
+        columns = list(schema) if schema is not None else header
+
+        positions = [header.index(col) for col in columns]
+
+        batch = []
+
+        for row in rows:
+
+            # openpyxl can report formatted but empty rows at the end
+            if all(value is None for value in row):
+                continue
+
+            batch.append([row[i] for i in positions])
+
+            if len(batch) == batch_size:
+                yield _batch_frame(batch, columns, schema)
+                batch = []
+
+
+        if batch:
+            yield _batch_frame(batch, columns, schema)
+
+    finally:
+        workbook.close()
+
+
+
+def _batch_frame(batch, columns, schema):
+    """Turns a list of rows into a DataFrame with the schema's types."""
+
+    diamonds = pd.DataFrame(batch, columns = columns)
+
+    if schema is None:
+        return diamonds
+
+    for col, dtype in schema.items():
+
+        # None and empty cells become NaN before the type is applied
+        diamonds[col] = pd.to_numeric(diamonds[col]).astype(dtype)
+
+    return diamonds
+
+
+
+###############################################################################
+# Memory-mapped column store
+###############################################################################
+
+"""
+    A column store is a folder with one .npy file per column and a small
+    columns.json describing them (naming the files of the current build
+    and recording the size and modification time of the file the store
+    was built from). Opening it maps the files into memory
+    instead of reading them, so start-up takes milliseconds and only the
+    columns (and pages) that are used are ever read from disk. Text columns,
+    such as the store names after stage 8, are kept as category codes.
+"""
+
+STORE_META = 'columns.json'
+
+
+
+def column_store_path(name):
+    """Returns the column store folder used for a stage or workbook."""
+
+    return stage_path(name, '.columns')
+
+
+
+def _read_meta(directory):
+    """Returns the columns.json of a store (None if there is none)."""
+
+    try:
+        with open(os.path.join(directory, STORE_META)) as handle:
+            meta = json.load(handle)
+
+    except FileNotFoundError:
+        return None
+
+    # stores written before the source was recorded
+    if isinstance(meta, list):
+        meta = {'source' : None, 'columns' : meta}
+
+    return meta
+
+
+
+def _source_stamp(path):
+    """Returns the size and modification time of a file."""
+
+    info = os.stat(path)
+
+    return {'size' : info.st_size, 'mtime_ns' : info.st_mtime_ns}
+
+
+
+def write_column_store(diamonds, directory, stamp = None):
+    """Writes every column of a DataFrame to a column store.
+
+    Each build writes new files (named after the build), so rebuilding a
+    store never overwrites files that another process may have mapped.
+    stamp is the _source_stamp of the file the DataFrame was read from,
+    if any (taken before reading it), so load_columns can tell when the
+    file changes.
+    """
+
+    os.makedirs(directory, exist_ok = True)
+
+    old = _read_meta(directory)
+
+    previous = ({entry['file'] for entry in old['columns']} if old
+                else set())
+
+    build = f'{time.time_ns():x}'
+
+    meta = []
+
+    for position, col in enumerate(diamonds.columns):
+
+        values = diamonds[col]
+
+        entry = {'name' : str(col),
+                 'file' : f'{build}_{position:03d}.npy'}
+
+
+        if (isinstance(values.dtype, pd.CategoricalDtype) or
+                not pd.api.types.is_numeric_dtype(values.dtype)):
+
+            values = values.astype('category')
+
+            entry['categories'] = values.cat.categories.tolist()
+
+            values = values.cat.codes
+
+
+        array = values.to_numpy()
+
+        entry['dtype'] = str(array.dtype)
+
+        np.save(os.path.join(directory, entry['file']), array)
+
+        meta.append(entry)
+
+
+    # the new columns.json replaces the old one in a single step, so a
+    # reader sees either the old store or the new one, never a mix
+    partial = os.path.join(directory, f'{STORE_META}.{os.getpid()}')
+
+    with open(partial, 'w') as handle:
+        json.dump({'source' : stamp, 'columns' : meta}, handle, indent = 1)
+
+    os.replace(partial, os.path.join(directory, STORE_META))
+
+
+    # files of older builds are removed; the previous build is kept for
+    # readers that opened it just before the switch
+    keep = previous | {entry['file'] for entry in meta}
+
+    for name in os.listdir(directory):
+        if name.endswith('.npy') and name not in keep:
+            os.remove(os.path.join(directory, name))
+
+    return directory
+
+
+
+def open_column_store(directory, columns = None):
+    """Opens a column store as a DataFrame backed by memory-mapped files.
+
+    Only the columns asked for are mapped. The mapping is copy-on-write,
+    so the DataFrame can be changed without touching the files.
+    """
+
+    meta = _read_meta(directory)['columns']
+
+    if columns is not None:
+        wanted = list(columns)
+        by_name = {entry['name'] : entry for entry in meta}
+        meta = [by_name[col] for col in wanted]
+
+
+    data = {}
+
+    for entry in meta:
+
+        array = np.load(os.path.join(directory, entry['file']),
+                        mmap_mode = 'c')
+
+        if 'categories' in entry:
+            array = pd.Categorical.from_codes(array, entry['categories'])
+
+        data[entry['name']] = array
+
+
+    return pd.DataFrame(data, copy = False)
+
+
+
+def _source_path(name):
+    """Returns the file a stage is actually loaded from."""
+
+    path = stage_path(name)
+
+    if os.path.exists(path):
+        return path
+
+    return stage_path(name, EXCEL_EXT)
+
+
+
+def load_columns(name, columns = None):
+    """Loads a stage or workbook through its column store.
+
+    The first call reads the file and writes <name>.columns next to it;
+    later calls open the column store directly, as long as the file still
+    has the size and modification time the store was built from (a file
+    replaced by an older copy is caught as well as a newer one).
+    """
+
+    directory = column_store_path(name)
+
+    meta = _read_meta(directory)
+
+    stamp = _source_stamp(_source_path(name))
+
+    if meta is None or meta['source'] != stamp:
+
+        write_column_store(compact_schema(load_stage(name)), directory,
+                           stamp = stamp)
+
+    return open_column_store(directory, columns)
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+
+@author: ArthurFMendes
+
+Purpose:
+    This code is meant to count and flag missing values in the diamond
+    dataset in a single pass, either on a whole DataFrame or one batch at a
+    time, so that files larger than memory can be checked the same way as
+    in stage 6.
+"""
+
+###############################################################################
+# Importing libraries
+###############################################################################
+
+import numpy as np # fast arrays (bit operations)
+import pandas as pd # data science essentials (DataFrame, Series)
+
+
+
+###############################################################################
+# Columns that can be missing
+###############################################################################
+
+# Stage 6 creates an m_ flag for each of these columns
+MISSING_COLUMNS = ['carat', 'color', 'clarity', 'cut']
+
+
+# All m_ flags packed in one column: bit i is set when MISSING_COLUMNS[i]
+# is missing (carat = 1, color = 2, clarity = 4, cut = 8)
+MISSING_MASK = 'm_mask'
+
+
+
+###############################################################################
+# Missing value flags
+###############################################################################
+
+def flag_missing(diamonds, columns = MISSING_COLUMNS):
+    """Adds the m_ flags (1 if a value is missing, 0 if not), as uint8
+    like the flags of the stage files.
+
+    The flags are created for every column in columns, not only for the
+    ones with missing values, so that all batches share the same schema.
+    """
+
+    for col in columns:
+        diamonds['m_'+col] = diamonds[col].isnull().astype('uint8')
+
+    return diamonds
+
+
+
+def _mask_dtype(columns):
+    """Returns the smallest unsigned type with one bit per column."""
+
+    for dtype in ('uint8', 'uint16', 'uint32', 'uint64'):
+        if len(columns) <= np.dtype(dtype).itemsize * 8:
+            return dtype
+
+    raise ValueError('Too many columns for one missing value mask.')
+
+
+
+def decode_missing(mask, col, columns = MISSING_COLUMNS):
+    """Returns the 0/1 missing flags of one column (as an array) from a
+    packed mask."""
+
+    return (np.asarray(mask) >> columns.index(col)) & 1
+
+
+
+###############################################################################
+# Single-pass missing value profile
+###############################################################################
+
+def profile_missing(diamonds, columns = MISSING_COLUMNS):
+    """Counts missing values and builds the packed mask in one pass.
+
+    Every column is scanned once (integer columns cannot hold NaN and are
+    not scanned at all). Returns the profile, a DataFrame with one row per
+    column holding count, missing, missing_pct (share of all observations)
+    and missing_ratio (share of the values present) as in stage 6, and the
+    mask as a Series named m_mask.
+    """
+
+    rows = len(diamonds)
+
+    missing = {}
+
+    mask = np.zeros(rows, dtype = _mask_dtype(columns))
+
+
+    for col in diamonds.columns:
+
+        values = diamonds[col]
+
+        if values.dtype.kind in 'iub':
+            missing[col] = 0
+            continue
+
+        nulls = values.isnull().to_numpy()
+
+        missing[col] = int(nulls.sum())
+
+        if col in columns:
+            mask |= nulls.astype(mask.dtype) << columns.index(col)
+
+
+    profile = _profile_frame(pd.Series(missing, dtype = 'int64'), rows)
+
+    mask = pd.Series(mask, index = diamonds.index, name = MISSING_MASK)
+
+    return profile, mask
+
+
+
+def _profile_frame(missing, rows):
+    """Builds the missing value profile from the missing counts."""
+
+    profile = pd.DataFrame({'count'   : rows - missing,
+                            'missing' : missing})
+
+    profile['missing_pct'] = profile['missing'] / rows
+
+    profile['missing_ratio'] = profile['missing'] / profile['count']
+
+    return profile
+
+
+
+def add_missing_mask(diamonds, columns = MISSING_COLUMNS):
+    """Adds the packed m_mask column and returns (diamonds, profile)."""
+
+    profile, mask = profile_missing(diamonds, columns)
+
+    diamonds[MISSING_MASK] = mask
+
+    return diamonds, profile
+
+
+
+def expand_missing(diamonds, columns = MISSING_COLUMNS):
+    """Replaces m_mask by the separate m_ flag columns (as uint8)."""
+
+    if MISSING_MASK not in diamonds.columns:
+        return diamonds
+
+    diamonds = diamonds.copy()
+
+    mask = diamonds.pop(MISSING_MASK).to_numpy()
+
+    for col in columns:
+        diamonds['m_'+col] = decode_missing(mask, col, columns).astype('uint8')
+
+    return diamonds
+
+
+
+@pd.api.extensions.register_dataframe_accessor('m_flags')
+class MissingAccessor:
+    """Reads the m_ flags out of m_mask without storing them.
+
+    diamonds.m_flags['carat'] (or diamonds.m_flags['m_carat']) decodes one
+    flag when it is needed; diamonds.m_flags.flags() decodes all of them.
+    For a mask built from other columns than MISSING_COLUMNS, pass the
+    same columns to flag() and flags().
+    """
+
+    def __init__(self, diamonds):
+
+        self._diamonds = diamonds
+
+
+
+    def __getitem__(self, col):
+
+        return self.flag(col)
+
+
+
+    def flag(self, col, columns = MISSING_COLUMNS):
+        """Decodes the m_ flag of one column."""
+
+        if col.startswith('m_'):
+            col = col[2:]
+
+        mask = self._diamonds[MISSING_MASK]
+
+        return pd.Series(decode_missing(mask, col, columns),
+                         index = mask.index,
+                         name = 'm_'+col)
+
+
+
+    def flags(self, columns = MISSING_COLUMNS):
+
+        return pd.DataFrame({'m_'+col : self.flag(col, columns)
+                             for col in columns})
+
+
+
+###############################################################################
+# Missing value counts over batches
+###############################################################################
+
+def missing_profile(batches):
+    """Counts the observations and missing values over a stream of batches.
+
+    Returns the same profile as profile_missing, for all the batches
+    together (an empty profile if there are no batches, as for a workbook
+    with only a header).
+    """
+
+    missing = None
+    rows = 0
+
+    for batch in batches:
+
+        batch_profile, _ = profile_missing(batch)
+
+        if missing is None:
+            missing = batch_profile['missing']
+        else:
+            missing = missing.add(batch_profile['missing'], fill_value = 0)
+
+        rows += len(batch)
+
+
+    if missing is None:
+        missing = pd.Series(dtype = 'int64')
+
+    return _profile_frame(missing.astype('int64'), rows)
+
+
+
+def iter_flagged(batches, columns = MISSING_COLUMNS):
+    """Yields each batch with its m_ flags added."""
+
+    for batch in batches:
+        yield flag_missing(batch, columns)
@@ -0,0 +1,873 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+
+@author: ArthurFMendes
+
+Purpose:
+    This code is meant to flag the outliers of stage 7 (price, carat by
+    channel, clarity, color and cut) for all rows at once, using whole
+    column comparisons instead of a loop over the rows, from the stage 7
+    limits, from rules kept in a file or from fences computed from the
+    data (all at once, or batch by batch as new listings arrive).
+"""
+
+###############################################################################
+# Importing libraries
+###############################################################################
+
+import functools
+import json
+import re
+
+import numpy as np # fast arrays (comparisons, lookups)
+import pandas as pd # data science essentials (groupby, quantile)
+
+from diamond_sketch import KLLSketch
+
+
+
+###############################################################################
+# Outlier limits
+###############################################################################
+
+# The cutoffs chosen from the histograms in stage 7 (exclusive). Carat
+# limits depend on the channel; a channel without a limit is never flagged.
+STAGE7_LIMITS = {'price_hi'   : 12500,
+                 'carat_hi'   : {0 : 2.03,
+                                 1 : 1.25,
+                                 2 : 1.5},
+                 'clarity_lo' : 3,
+                 'clarity_hi' : 9,
+                 'color_hi'   : 7,
+                 'cut_flag'   : 1}
+
+
+# Flags in the order stage 7 adds them; out_sum is their sum
+OUTLIER_FLAGS = ['out_price', 'out_carat', 'out_clarity', 'out_color',
+                 'out_cut']
+
+
+
+###############################################################################
+# Outlier rules
+###############################################################################
+
+"""
+    Outlier rules can also be kept in a JSON (or YAML) file that maps each
+    flag to a list of rules, for example
+
+        {"out_carat" : ["carat > 2.03 where channel == 0",
+                        "carat > 1.25 where channel == 1"],
+         "out_cut"   : ["cut == 1"]}
+
+    A row is flagged when any rule of the flag holds; missing values are
+    never flagged, as in the stage 7 loops. compile_rules()
+    merges all the rules of a flag that compare the same column in the same
+    direction into one limit per value of the where column (a threshold
+    lookup table), so the file can hold hundreds of rules and still be
+    evaluated with a handful of whole-column comparisons.
+"""
+
+_RULE = re.compile(r"""^\s*(?P<column>\w+)\s*(?P<op>>=|<=|==|>|<)\s*
+                       (?P<value>[^\s]+)
+                       (\s+where\s+(?P<key>\w+)\s*==\s*(?P<key_value>.+?))?
+                       \s*$""", re.VERBOSE)
+
+
+_COMPARE = {'>'  : np.greater,
+            '>=' : np.greater_equal,
+            '<'  : np.less,
+            '<=' : np.less_equal}
+
+
+
+def _literal(text):
+    """Reads a number, or a (quoted) label such as 'online'."""
+
+    text = text.strip()
+
+    for kind in (int, float):
+        try:
+            return kind(text)
+        except ValueError:
+            pass
+
+    return text.strip('\'"')
+
+
+
+def parse_rule(text):
+    """Splits a rule such as "carat > 2.03 where channel == 0" into its
+    column, operator, value and (optionally) the where column and value."""
+
+    match = _RULE.match(text)
+
+    if match is None:
+        raise ValueError(f'Cannot read outlier rule: {text!r}')
+
+    rule = {'column' : match['column'],
+            'op'     : match['op'],
+            'value'  : _literal(match['value']),
+            'key'    : match['key']}
+
+    if rule['key'] is not None:
+        rule['key_value'] = _literal(match['key_value'])
+
+    return rule
+
+
+
+def load_rules(path):
+    """Reads a rule file (.json, or .yml/.yaml if PyYAML is installed)."""
+
+    with open(path) as handle:
+
+        if path.endswith(('.yml', '.yaml')):
+
+            import yaml
+
+            return yaml.safe_load(handle)
+
+        return json.load(handle)
+
+
+
+def stage7_rules(limits = STAGE7_LIMITS):
+    """Writes the stage 7 limits as rules (what outlier_rules.json holds)."""
+
+    return {'out_price'   : [f"price > {limits['price_hi']}"],
+            'out_carat'   : [f'carat > {limit} where channel == {channel}'
+                             for channel, limit
+                             in limits['carat_hi'].items()],
+            'out_clarity' : [f"clarity < {limits['clarity_lo']}",
+                             f"clarity > {limits['clarity_hi']}"],
+            'out_color'   : [f"color > {limits['color_hi']}"],
+            'out_cut'     : [f"cut == {limits['cut_flag']}"]}
+
+
+
+class CompiledRules:
+    """Outlier rules merged into one comparison per flag, column, operator
+    and where column. Build it with compile_rules()."""
+
+    def __init__(self, flags, groups):
+
+        self.flags = list(flags)
+        self.groups = groups
+
+
+
+    def masks(self, diamonds):
+        """Returns one boolean array per flag."""
+
+        masks = {flag : np.zeros(len(diamonds), dtype = bool)
+                 for flag in self.flags}
+
+        columns = {}
+
+        for (flag, column, op, key), limits in self.groups.items():
+
+            if column not in columns:
+                columns[column] = diamonds[column].to_numpy(dtype = float)
+
+            masks[flag] |= self._evaluate(diamonds, columns[column], op,
+                                          key, limits)
+
+        return masks
+
+
+
+    @staticmethod
+    def _evaluate(diamonds, values, op, key, limits):
+        """Evaluates one merged group of rules."""
+
+        if op == '==':
+
+            if key is None:
+                return np.isin(values, limits)
+
+            keys = diamonds[key].to_numpy()
+
+            hits = np.zeros(len(values), dtype = bool)
+
+            for key_value, targets in limits.items():
+                hits |= (keys == key_value) & np.isin(values, targets)
+
+            return hits
+
+
+        if key is None:
+            return _COMPARE[op](values, limits)
+
+
+        # threshold of every row from its key; rows whose key has no rule
+        # get the last entry, a limit that is never crossed
+        positions = limits.index.get_indexer(diamonds[key])
+
+        never = np.inf if op in ('>', '>=') else -np.inf
+
+        lookup = np.append(limits.to_numpy(dtype = float), never)
+
+        return _COMPARE[op](values, lookup[positions])
+
+
+
+def compile_rules(rules):
+    """Merges the rules of every flag ({flag : [rule, ...]}).
+
+    Rules of a flag on the same column, operator and where column become
+    one limit per where value: the lowest limit for > and >=, the highest
+    for < and <=, and the set of values for ==.
+    """
+
+    groups = {}
+
+    for flag, texts in rules.items():
+
+        for text in texts:
+
+            rule = parse_rule(text)
+
+            group = (flag, rule['column'], rule['op'], rule['key'])
+
+            groups.setdefault(group, []).append(rule)
+
+
+    compiled = {}
+
+    for (flag, column, op, key), members in groups.items():
+
+        if key is None and op == '==':
+            compiled[flag, column, op, key] = [rule['value']
+                                               for rule in members]
+
+        elif key is None:
+            combine = min if op in ('>', '>=') else max
+            compiled[flag, column, op, key] = combine(rule['value']
+                                                      for rule in members)
+
+        elif op == '==':
+            targets = {}
+            for rule in members:
+                targets.setdefault(rule['key_value'],
+                                   []).append(rule['value'])
+            compiled[flag, column, op, key] = targets
+
+        else:
+            limits = pd.Series([rule['value'] for rule in members],
+                               index = [rule['key_value']
+                                        for rule in members])
+            combine = 'min' if op in ('>', '>=') else 'max'
+            compiled[flag, column, op, key] = (limits.groupby(level = 0)
+                                                     .agg(combine))
+
+
+    return CompiledRules(rules.keys(), compiled)
+
+
+
+###############################################################################
+# Flagging outliers
+###############################################################################
+
+def add_rule_flags(diamonds, compiled):
+    """Adds the flags of compiled rules and their sum, out_sum (as one-byte
+    integers), and returns diamonds."""
+
+    masks = compiled.masks(diamonds)
+
+    out_sum = np.zeros(len(diamonds), dtype = 'uint8')
+
+    for flag in compiled.flags:
+
+        diamonds[flag] = masks[flag].view('uint8')
+
+        out_sum += masks[flag]
+
+
+    diamonds['out_sum'] = out_sum
+
+    return diamonds
+
+
+
+def add_outlier_flags(diamonds, limits = STAGE7_LIMITS):
+    """Adds the stage 7 flags (OUTLIER_FLAGS) and out_sum for the given
+    limits, and returns diamonds."""
+
+    return add_rule_flags(diamonds, compile_rules(stage7_rules(limits)))
+
+
+
+###############################################################################
+# Data-driven fences
+###############################################################################
+
+"""
+    Instead of limits picked from the histograms, every column can get
+    fences computed from the data of each channel (or channel and store):
+
+        iqr: below Q1 - 1.5 * IQR or above Q3 + 1.5 * IQR (Tukey)
+        mad: more than 3 robust standard deviations (1.4826 * MAD) away
+             from the median
+
+    The quartiles and medians of all columns and groups come from one
+    grouped quantile aggregation, so the fences can be recomputed whenever
+    a new extract lands.
+"""
+
+FENCE_COLUMNS = ['price', 'carat', 'clarity', 'color', 'cut']
+
+
+# default multiplier of each method
+FENCE_K = {'iqr' : 1.5,
+           'mad' : 3.0}
+
+
+
+def outlier_fences(diamonds, columns = FENCE_COLUMNS, by = ('channel',),
+                   method = 'iqr', k = None):
+    """Returns the lower and upper fence of every column for every group.
+
+    The result has one row per group and a (column, 'lo' / 'hi') pair of
+    columns for each column.
+    """
+
+    k = FENCE_K[method] if k is None else k
+
+    by = list(by)
+
+    grouped = diamonds.groupby(by, observed = True)[list(columns)]
+
+    quartiles = grouped.quantile([0.25, 0.5, 0.75]).unstack()
+
+
+    fences = {}
+
+    for col in columns:
+
+        q1, median, q3 = (quartiles[col, q] for q in (0.25, 0.5, 0.75))
+
+        if method == 'iqr':
+            lo, hi = q1 - k * (q3 - q1), q3 + k * (q3 - q1)
+
+        else:
+            spread = k * 1.4826 * _group_mad(diamonds, col, by, median)
+            lo, hi = median - spread, median + spread
+
+        fences[col, 'lo'] = lo
+        fences[col, 'hi'] = hi
+
+
+    return pd.DataFrame(fences)
+
+
+
+def _group_mad(diamonds, col, by, median):
+    """Returns the median absolute deviation of a column in every group."""
+
+    positions = median.index.get_indexer(_group_keys(diamonds, by))
+
+    deviation = np.abs(diamonds[col].to_numpy(dtype = float) -
+                       median.to_numpy()[positions])
+
+    return (pd.Series(deviation, index = diamonds.index)
+              .groupby([diamonds[key] for key in by], observed = True)
+              .median()
+              .reindex(median.index))
+
+
+
+def _group_keys(diamonds, by):
+    """Returns the group of every row, as an Index to look groups up in."""
+
+    if len(by) == 1:
+        return pd.Index(diamonds[by[0]])
+
+    return pd.MultiIndex.from_frame(diamonds[by])
+
+
+
+def add_fence_flags(diamonds, fences):
+    """Flags values outside the fences of their group (out_<column>), adds
+    out_sum and returns diamonds. Groups without fences are never flagged.
+    """
+
+    by = list(fences.index.names)
+
+    positions = fences.index.get_indexer(_group_keys(diamonds, by))
+
+    columns = list(dict.fromkeys(col for col, _ in fences.columns))
+
+    out_sum = np.zeros(len(diamonds), dtype = 'uint8')
+
+    for col in columns:
+
+        # the last entry is used for unknown groups and flags nothing
+        lo = np.append(fences[col, 'lo'].to_numpy(dtype = float), -np.inf)
+        hi = np.append(fences[col, 'hi'].to_numpy(dtype = float), np.inf)
+
+        values = diamonds[col].to_numpy(dtype = float)
+
+        flag = (values < lo[positions]) | (values > hi[positions])
+
+        diamonds['out_'+col] = flag.view('uint8')
+
+        out_sum += flag
+
+
+    diamonds['out_sum'] = out_sum
+
+    return diamonds
+
+
+
+###############################################################################
+# Streaming outlier scores
+###############################################################################
+
+"""
+    For listings that arrive a few at a time, StreamingScorer keeps one
+    quantile sketch (see diamond_sketch) per channel and column. Each
+    micro-batch is flagged against the fences of everything seen before
+    it, then added to the sketches, so scoring a batch costs time in
+    proportion to the batch and memory stays at a few thousand values per
+    sketch however long the stream runs. The fences are those of
+    outlier_fences; for method = 'mad' the robust standard deviation is
+    estimated as IQR / 1.349 (the same as 1.4826 * MAD for normal data),
+    since the median absolute deviation cannot be read from a sketch.
+    A channel is not flagged until it has min_count values; the default
+    of 20 lets the smallest channels of the bundled data (43 and 48
+    diamonds) be flagged once about half of them have been seen.
+"""
+
+class StreamingScorer:
+    """Flags outliers in a stream of batches from running per-channel
+    quantile sketches."""
+
+    def __init__(self, columns = FENCE_COLUMNS, by = 'channel',
+                 method = 'iqr', k = None, min_count = 20,
+                 sketch_k = 200):
+
+        self.columns = list(columns)
+        self.by = by
+        self.method = method
+        self.k = FENCE_K[method] if k is None else k
+        self.min_count = min_count
+        self.sketch_k = sketch_k
+
+        # {group : {column : KLLSketch}}
+        self.sketches = {}
+
+
+
+    def update(self, batch):
+        """Adds a batch to the sketches of its channels."""
+
+        keys = batch[self.by].to_numpy()
+
+        for group in pd.unique(keys):
+
+            rows = keys == group
+
+            if group not in self.sketches:
+                self.sketches[group] = {col : KLLSketch(self.sketch_k)
+                                        for col in self.columns}
+
+            for col, sketch in self.sketches[group].items():
+                sketch.update(batch[col].to_numpy()[rows])
+
+        return self
+
+
+
+    def fences(self):
+        """Returns the current fences, laid out as outlier_fences does."""
+
+        fences = {}
+
+        for group, sketches in self.sketches.items():
+
+            row = {}
+
+            for col, sketch in sketches.items():
+
+                if sketch.count < self.min_count:
+                    row[col, 'lo'], row[col, 'hi'] = np.nan, np.nan
+                    continue
+
+                q1, median, q3 = sketch.quantile([0.25, 0.5, 0.75])
+
+                if self.method == 'iqr':
+                    row[col, 'lo'] = q1 - self.k * (q3 - q1)
+                    row[col, 'hi'] = q3 + self.k * (q3 - q1)
+
+                else:
+                    spread = self.k * (q3 - q1) / 1.349
+                    row[col, 'lo'] = median - spread
+                    row[col, 'hi'] = median + spread
+
+            fences[group] = row
+
+
+        fences = pd.DataFrame.from_dict(fences, orient = 'index').sort_index()
+
+        fences.index.name = self.by
+
+        return fences
+
+
+
+    def score(self, batch, learn = True):
+        """Returns a copy of batch with the out_* flags and out_sum, scored
+        against the batches seen so far; then (if learn) adds the batch.
+        """
+
+        if self.sketches:
+            flagged = add_fence_flags(batch.copy(), self.fences())
+
+        else:
+            flagged = batch.copy()
+
+            for col in self.columns:
+                flagged['out_'+col] = np.zeros(len(batch), dtype = 'uint8')
+
+            flagged['out_sum'] = np.zeros(len(batch), dtype = 'uint8')
+
+
+        if learn:
+            self.update(batch)
+
+        return flagged
+
+
+
+    def size(self):
+        """Returns the number of values held by all the sketches."""
+
+        return sum(sketch.size() for sketches in self.sketches.values()
+                   for sketch in sketches.values())
+
+
+
+###############################################################################
+# Multivariate robust outliers
+###############################################################################
+
+"""
+    The flags above look at one column at a time, so they miss diamonds
+    that are only unusual in combination (a high price for a small carat,
+    for example). robust_fit() estimates the centre and covariance of
+    carat, color, clarity and price (carat and price as logs) in each
+    channel with a minimum covariance determinant (MCD) search on a random
+    sample: starting from several small random subsets, it repeatedly
+    keeps the half of the sample closest to the current centre (C-steps)
+    and keeps the subset with the smallest covariance determinant, so a
+    minority of outliers cannot pull the estimate towards them.
+
+    Every row then gets its robust (Mahalanobis) distance from the centre
+    of its channel. Rows are scored in blocks small enough to stay in the
+    processor cache. A distance whose square is above the 97.5% quantile
+    of the chi-squared distribution is flagged in out_robust. Channels too
+    small for a reliable fit are left unscored.
+"""
+
+# cut is left out by default: it only takes the values 0 and 1, and most
+# diamonds of a channel share one of them, so the closest half of a channel
+# has a constant cut and every diamond with the other cut would be flagged
+# (stage 7 already flags cut on its own)
+ROBUST_COLUMNS = ['carat', 'color', 'clarity', 'price']
+
+
+# price and carat are right-skewed (see the stage 7 histograms); their logs
+# are much closer to the elliptical shape the distances assume
+ROBUST_LOG_COLUMNS = ('carat', 'price')
+
+
+# a channel needs this many complete rows per column to get its own fit;
+# with 10 rows per column even normal data is flagged about 9% of the time
+# at the 97.5% cutoff after the small-sample correction below, with 25
+# about 3.5%. Channels 0 and 1 of the bundled data (43 and 48 diamonds) are
+# too small and are left unscored.
+MIN_ROWS_PER_COLUMN = 25
+
+
+
+def _robust_values(diamonds, columns, log_columns):
+    """Returns the columns as one float array, logs taken."""
+
+    values = diamonds[list(columns)].to_numpy(dtype = float)
+
+    for position, col in enumerate(columns):
+        if col in log_columns:
+            values[:, position] = np.log(values[:, position])
+
+    return values
+
+
+
+def _fit_subset(sample, rows, ridge):
+    """Returns the mean and covariance of some rows of the sample (with a
+    small ridge, so that a column that is constant in the group, such as
+    cut, does not make the covariance singular)."""
+
+    subset = sample[rows]
+
+    covariance = np.cov(subset, rowvar = False) + ridge
+
+    return subset.mean(axis = 0), covariance
+
+
+
+def _chi2_quantile(q, p):
+    """Returns the q quantile of the chi-squared distribution with p
+    degrees of freedom (scipy.special loads much faster than scipy.stats)."""
+
+    from scipy.special import chdtri
+
+    return chdtri(p, 1 - q)
+
+
+
+def _squared_distances(values, location, covariance):
+    """Returns the squared Mahalanobis distance of every row."""
+
+    # with L the Cholesky factor of the precision, d^2 = |(x - m) L|^2
+    whiten = np.linalg.cholesky(np.linalg.inv(covariance))
+
+    z = (values - location) @ whiten
+
+    return np.einsum('ij,ij->i', z, z)
+
+
+
+def _raw_mcd(sample, starts, max_steps, rng):
+    """Returns the location and covariance of the closest half of sample
+    found by the C-step search, and the ridge used."""
+
+    n, p = sample.shape
+
+    h = (n + p + 1) // 2
+
+    ridge = 1e-6 * np.diag(np.var(sample, axis = 0) + 1e-12)
+
+
+    best = None
+
+    for _ in range(starts):
+
+        rows = rng.choice(n, p + 1, replace = False)
+
+        location, covariance = _fit_subset(sample, rows, ridge)
+
+        for _ in range(max_steps):
+
+            distances = _squared_distances(sample, location, covariance)
+
+            new_rows = np.sort(np.argpartition(distances, h - 1)[:h])
+
+            if np.array_equal(new_rows, rows):
+                break
+
+            rows = new_rows
+
+            location, covariance = _fit_subset(sample, rows, ridge)
+
+
+        determinant = np.linalg.slogdet(covariance)[1]
+
+        if best is None or determinant < best[0]:
+            best = (determinant, location, covariance)
+
+
+    _, location, covariance = best
+
+    # the covariance of the closest half is too small: scale it so that
+    # the median distance matches a normal distribution
+    distances = _squared_distances(sample, location, covariance)
+
+    covariance = covariance * np.median(distances) / _chi2_quantile(0.5, p)
+
+    return location, covariance, ridge
+
+
+
+def _reweight(sample, location, covariance, ridge):
+    """Re-estimates location and covariance from every row within the
+    97.5% cutoff of a raw fit (scaled as in _raw_mcd)."""
+
+    p = sample.shape[1]
+
+    distances = _squared_distances(sample, location, covariance)
+
+    inliers = np.flatnonzero(distances <= _chi2_quantile(0.975, p))
+
+    location, covariance = _fit_subset(sample, inliers, ridge)
+
+    distances = _squared_distances(sample, location, covariance)
+
+    covariance = covariance * np.median(distances) / _chi2_quantile(0.5, p)
+
+    return location, covariance
+
+
+
+"""
+    Scaling by the median distance is only right for large samples: with a
+    few dozen rows the covariance still comes out too small and even normal
+    data gets flagged several times more often than the cutoff says. As in
+    Pison, Van Aelst and Willems (2002), the raw and the reweighted
+    covariances are multiplied by small-sample factors, chosen so that the
+    average of det(covariance) ** (1 / p) is 1 on standard normal samples
+    of the same size. The factors are simulated once per sample size (they
+    are within about 1% of 1 beyond SMALL_SAMPLE_ROWS rows per column, and
+    are left out there).
+"""
+
+SMALL_SAMPLE_ROWS = 100
+
+SMALL_SAMPLE_REPS = 50
+
+
+
+@functools.lru_cache(maxsize = None)
+def _small_sample_factors(n, p, starts, max_steps):
+    """Returns the raw and reweighted small-sample factors for n rows and
+    p columns."""
+
+    if n >= SMALL_SAMPLE_ROWS * p:
+        return 1.0, 1.0
+
+    rng = np.random.default_rng(0)
+
+    samples = [rng.standard_normal((n, p)) for _ in range(SMALL_SAMPLE_REPS)]
+
+    raw = [_raw_mcd(sample, starts, max_steps, rng) for sample in samples]
+
+    raw_factor = 1 / np.mean([np.linalg.det(covariance) ** (1 / p)
+                              for _, covariance, _ in raw])
+
+    reweighted = [_reweight(sample, location, covariance * raw_factor, ridge)
+                  for sample, (location, covariance, ridge)
+                  in zip(samples, raw)]
+
+    factor = 1 / np.mean([np.linalg.det(covariance) ** (1 / p)
+                          for _, covariance in reweighted])
+
+    return raw_factor, factor
+
+
+
+def mcd(sample, starts = 10, max_steps = 30, seed = 0):
+    """Returns the robust location and covariance of the rows of sample
+    (a 2-d array without missing values), by the FastMCD C-step search,
+    reweighting and small-sample correction.
+    """
+
+    n, p = sample.shape
+
+    raw_factor, factor = _small_sample_factors(n, p, starts, max_steps)
+
+    location, covariance, ridge = _raw_mcd(sample, starts, max_steps,
+                                           np.random.default_rng(seed))
+
+    # re-estimate from every row that is not an outlier (reweighting)
+    location, covariance = _reweight(sample, location,
+                                     covariance * raw_factor, ridge)
+
+    return location, covariance * factor
+
+
+
+def robust_fit(diamonds, columns = ROBUST_COLUMNS, by = 'channel',
+               sample = 5000, seed = 0, log_columns = ROBUST_LOG_COLUMNS,
+               min_rows = None):
+    """Fits the MCD centre and covariance of every group on at most sample
+    complete rows. Returns {group : (location, covariance)}.
+
+    Groups with fewer than min_rows complete rows (MIN_ROWS_PER_COLUMN
+    per column by default) are not fitted, and their rows are not scored.
+    """
+
+    if min_rows is None:
+        min_rows = MIN_ROWS_PER_COLUMN * len(columns)
+
+    rng = np.random.default_rng(seed)
+
+    values = _robust_values(diamonds, columns, log_columns)
+
+    complete = ~np.isnan(values).any(axis = 1)
+
+    keys = diamonds[by].to_numpy()
+
+    fits = {}
+
+    for group in pd.unique(keys):
+
+        rows = np.flatnonzero((keys == group) & complete)
+
+        if len(rows) < min_rows:
+            continue
+
+        if len(rows) > sample:
+            rows = rng.choice(rows, sample, replace = False)
+
+        fits[group] = mcd(values[rows], seed = seed)
+
+
+    return fits
+
+
+
+def robust_distances(diamonds, fits, columns = ROBUST_COLUMNS,
+                     by = 'channel', block_size = 65536,
+                     log_columns = ROBUST_LOG_COLUMNS):
+    """Returns the robust distance of every row from the centre of its
+    group (NaN for rows with missing values or a group without a fit)."""
+
+    values = _robust_values(diamonds, columns, log_columns)
+
+    keys = diamonds[by].to_numpy()
+
+    squared = np.full(len(diamonds), np.nan)
+
+    for group, (location, covariance) in fits.items():
+
+        whiten = np.linalg.cholesky(np.linalg.inv(covariance))
+
+        rows = np.flatnonzero(keys == group)
+
+        for start in range(0, len(rows), block_size):
+
+            block = rows[start : start + block_size]
+
+            z = (values[block] - location) @ whiten
+
+            squared[block] = np.einsum('ij,ij->i', z, z)
+
+
+    return np.sqrt(squared)
+
+
+
+def add_robust_flags(diamonds, columns = ROBUST_COLUMNS, by = 'channel',
+                     quantile = 0.975, sample = 5000, seed = 0,
+                     log_columns = ROBUST_LOG_COLUMNS, min_rows = None):
+    """Adds robust_distance and the out_robust flag (kept out of out_sum)
+    and returns diamonds. Rows of groups too small to fit get a missing
+    distance and are not flagged."""
+
+    fits = robust_fit(diamonds, columns, by, sample, seed, log_columns,
+                      min_rows)
+
+    distances = robust_distances(diamonds, fits, columns, by,
+                                 log_columns = log_columns)
+
+    cutoff = np.sqrt(_chi2_quantile(quantile, len(columns)))
+
+    diamonds['robust_distance'] = distances.astype('float32')
+
+    diamonds['out_robust'] = (distances > cutoff).view('uint8')
+
+    return diamonds
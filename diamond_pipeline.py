@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+
+@author: ArthurFMendes
+
+Purpose:
+    This code is meant to run the whole diamond analysis (stages 6 through
+    9) in one go, passing the dataset from stage to stage in memory.
+"""
+
+###############################################################################
+# Importing libraries
+###############################################################################
+
+import time
+
+import pandas as pd # data science essentials (DataFrame, get_dummies)
+
+from diamond_io import compact_schema, load_columns, save_stage
+from diamond_impute import fit_imputer
+from diamond_missing import add_missing_mask, expand_missing
+from diamond_outliers import (add_outlier_flags, add_fence_flags,
+                              outlier_fences, add_robust_flags,
+                              ROBUST_COLUMNS, ROBUST_LOG_COLUMNS,
+                              MIN_ROWS_PER_COLUMN)
+
+
+
+###############################################################################
+# Settings shared with the stage scripts
+###############################################################################
+
+file ='diamonds_missing_values.xlsx'
+
+
+# Outlier cutoff notes (exclusive), see 7_diamond_outlier_imputation.py
+price_limit_hi = 12500
+
+carat_limit_0 = 2.03
+
+carat_limit_1 = 1.25
+
+carat_limit_2 = 1.5
+
+color_limit_hi = 7
+
+clarity_limit_lo = 3
+
+clarity_limit_hi = 9
+
+
+# None uses the cutoffs above; 'iqr' or 'mad' computes fences for each
+# channel from the data instead (see diamond_outliers.outlier_fences)
+fence_method = None
+
+
+# True also adds the multivariate robust_distance and out_robust columns
+# (see diamond_outliers.add_robust_flags); off by default, as the fit adds
+# about half a second to the stage
+robust_outliers = False
+
+
+# Labels used in 8_diamond_eda.py
+channel_labels = {0: 'mall',
+                  1: 'independent',
+                  2: 'online'}
+
+
+store_labels = {1: "Goodman's",
+                2: "Chalmer's",
+                3: "Fred Meyer",
+                4: 'R. Holland',
+                5: "Ausman's",
+                6: "University",
+                7: "Kay",
+                8: "Zales",
+                9: "Danford",
+                10: "Blue Nile",
+                11: "Ashford"}
+
+
+# File names each stage would have written on its own
+checkpoint_names = {'impute'  : 'diamonds_imputed',
+                    'flag'    : 'diamonds_flagged',
+                    'explore' : 'diamonds_explored',
+                    'regress' : 'diamonds_wide'}
+
+
+
+###############################################################################
+# Stage 6 - Imputing missing values
+###############################################################################
+
+def impute_missing(diamonds, report = None):
+    """Flags and imputes missing values (see stage 6).
+
+    The m_ flags are kept packed in a single m_mask column (see
+    diamond_missing); the missing value profile goes to the report.
+    """
+
+    diamonds, profile = add_missing_mask(diamonds.copy())
+
+    if report is not None:
+        report['missing'] = profile
+
+
+    # carat is filled with its mean (rounded), color and cut with their
+    # median and clarity with its mean (truncated to an integer)
+    return fit_imputer(diamonds).transform(diamonds, copy = False)
+
+
+
+###############################################################################
+# Stage 7 - Flagging outliers
+###############################################################################
+
+def flag_outliers(diamonds, report = None):
+    """Adds the out_* outlier flags and their sum (see stage 7)."""
+
+    if fence_method is not None:
+        diamonds = add_fence_flags(diamonds.copy(),
+                                   outlier_fences(diamonds,
+                                                  method = fence_method))
+
+        if robust_outliers:
+            diamonds = add_robust_flags(diamonds)
+
+        return diamonds
+
+
+    # carat limits depend on the channel
+    limits = {'price_hi'   : price_limit_hi,
+              'carat_hi'   : {0: carat_limit_0,
+                              1: carat_limit_1,
+                              2: carat_limit_2},
+              'clarity_lo' : clarity_limit_lo,
+              'clarity_hi' : clarity_limit_hi,
+              'color_hi'   : color_limit_hi,
+              'cut_flag'   : 1}
+
+    diamonds = add_outlier_flags(diamonds.copy(), limits)
+
+    # robust distance over carat, color, clarity and price, per channel
+    if robust_outliers:
+        diamonds = add_robust_flags(diamonds)
+
+    return diamonds
+
+
+
+###############################################################################
+# Stage 8 - Exploratory data analysis
+###############################################################################
+
+def explore(diamonds, report = None):
+    """Builds the correlation matrix and relabels channel and store."""
+
+    if report is not None:
+        report['corr'] = expand_missing(diamonds).corr().round(2)
+
+    diamonds = diamonds.copy()
+
+    diamonds['channel'] = diamonds['channel'].map(channel_labels)
+
+    diamonds['store'] = diamonds['store'].map(store_labels)
+
+    return diamonds
+
+
+
+###############################################################################
+# Stage 9 - Regression
+###############################################################################
+
+def regress(diamonds, report = None):
+    """Fits the price models and returns the one-hot encoded dataset."""
+
+    import statsmodels.formula.api as smf # regression modeling
+
+    diamonds = expand_missing(diamonds)
+
+    if report is not None:
+
+        report['lm_price_carat'] = smf.ols(formula = 'price ~ carat',
+                                           data = diamonds).fit()
+
+        m_cols = [col for col in diamonds.columns if col.startswith('m_')]
+
+        out_cols = ['out_price', 'out_carat', 'out_clarity', 'out_cut']
+
+        formula = ' + '.join(['price ~ carat', 'clarity', 'color', 'cut',
+                              'C(channel)', 'C(store)'] + m_cols + out_cols)
+
+        report['lm_full'] = smf.ols(formula = formula, data = diamonds).fit()
+
+
+    channel_dummies = pd.get_dummies(list(diamonds['channel']))
+    store_dummies = pd.get_dummies(list(diamonds['store']))
+
+    return pd.concat([diamonds.reset_index(drop = True),
+                      channel_dummies, store_dummies],
+                     axis = 1)
+
+
+
+###############################################################################
+# Running the pipeline
+###############################################################################
+
+stages = [('impute',  impute_missing),
+          ('flag',    flag_outliers),
+          ('explore', explore),
+          ('regress', regress)]
+
+
+
+def stage_params(name):
+    """Returns the settings a stage depends on (part of its cache key)."""
+
+    if name == 'flag':
+        return {'price_limit_hi'   : price_limit_hi,
+                'carat_limit_0'    : carat_limit_0,
+                'carat_limit_1'    : carat_limit_1,
+                'carat_limit_2'    : carat_limit_2,
+                'color_limit_hi'   : color_limit_hi,
+                'clarity_limit_lo' : clarity_limit_lo,
+                'clarity_limit_hi' : clarity_limit_hi,
+                'fence_method'     : fence_method,
+                'robust_outliers'  : robust_outliers,
+                'robust_columns'   : ROBUST_COLUMNS,
+                'robust_logs'      : ROBUST_LOG_COLUMNS,
+                'robust_min_rows'  : MIN_ROWS_PER_COLUMN}
+
+    if name == 'explore':
+        return {'channel_labels' : channel_labels,
+                'store_labels'   : store_labels}
+
+    return {}
+
+
+
+def run_pipeline(diamonds = None, checkpoints = False, excel = False,
+                 cache = None, carat_float32 = False):
+    """Runs stages 6 through 9 on one in-memory DataFrame.
+
+    Returns the final (wide) dataset and a report with the correlation
+    matrix, the fitted models and the time taken by every stage. With
+    checkpoints = True each stage output is also saved like the scripts do.
+    When a StageCache is given, stages whose input, settings and code are
+    unchanged are loaded from it instead of being run. Every stage output
+    is cast to the compact schema (see diamond_io.compact_schema).
+    """
+
+    report = {'timings' : {}}
+
+    start = time.perf_counter()
+
+    if diamonds is None:
+        diamonds = load_columns(file)
+
+    report['timings']['load'] = time.perf_counter() - start
+
+
+    for name, stage in stages:
+
+        stage_start = time.perf_counter()
+
+        if cache is None:
+            diamonds = stage(diamonds, report)
+
+        else:
+            diamonds, extras = cache.run(name, stage, diamonds,
+                                         stage_params(name))
+            report.update(extras)
+
+        diamonds = compact_schema(diamonds, carat_float32 = carat_float32)
+
+        if checkpoints:
+            save_stage(expand_missing(diamonds), checkpoint_names[name],
+                       excel = excel, carat_float32 = carat_float32)
+
+        report['timings'][name] = time.perf_counter() - stage_start
+
+
+    report['timings']['total'] = time.perf_counter() - start
+
+    return diamonds, report
+
+
+
+if __name__ == '__main__':
+
+    from diamond_cache import StageCache
+
+    cache = StageCache()
+
+    diamonds, report = run_pipeline(checkpoints = True, cache = cache)
+
+    for name, seconds in report['timings'].items():
+        print(f'{name:<10} {seconds:8.3f} s')
+
+    print(cache.report())
@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+
+@author: ArthurFMendes
+
+Purpose:
+    This code is meant to load the plotting libraries only when a plot is
+    actually drawn, to skip every plot when the scripts run as a batch job
+    (compute-only mode) and to render saved figures in parallel.
+"""
+
+###############################################################################
+# Importing libraries
+###############################################################################
+
+import importlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+
+
+###############################################################################
+# Compute-only mode
+###############################################################################
+
+"""
+    Compute-only mode is switched on by setting the environment variable
+    DIAMONDS_COMPUTE_ONLY=1 (or by calling set_compute_only(True) before
+    the first plot). In this mode matplotlib and seaborn are never
+    imported, and every plotting call (plt.show(), plt.savefig(),
+    sns.pairplot(), smg.regressionplots.plot_fit(), ...) does nothing.
+    The statsmodels.graphics package itself is still loaded by
+    statsmodels.formula.api; only its plotting functions, which would
+    import matplotlib, are skipped.
+
+    compute_only may change after a script has imported this module, so
+    read it as diamond_plots.compute_only when it is checked.
+"""
+
+compute_only = os.environ.get('DIAMONDS_COMPUTE_ONLY', '') not in ('', '0')
+
+
+
+def set_compute_only(value = True):
+    """Turns compute-only mode on or off."""
+
+    global compute_only
+
+    compute_only = value
+
+
+
+class Skipped:
+    """Stands in for any plotting object while in compute-only mode.
+
+    Every attribute, call or index returns the same object, so chains such
+    as my_plot.set_axis_labels(...) or figure.axes[0] keep working.
+    Unpacking gives two of them, as in fig, ax = plt.subplots().
+    """
+
+    def __getattr__(self, name):
+        return self
+
+    def __call__(self, *args, **kwargs):
+        return self
+
+    def __getitem__(self, key):
+        return self
+
+    def __iter__(self):
+        return iter((self, self))
+
+    def __repr__(self):
+        return '<skipped plot>'
+
+
+
+skipped = Skipped()
+
+
+
+###############################################################################
+# Lazy imports
+###############################################################################
+
+class LazyModule:
+    """Imports a module the first time one of its attributes is used."""
+
+    def __init__(self, name):
+
+        self._name = name
+        self._module = None
+
+
+
+    def __getattr__(self, attr):
+
+        if compute_only:
+            return skipped
+
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+
+        try:
+            return getattr(self._module, attr)
+
+        # a submodule that nothing has imported yet, such as
+        # statsmodels.graphics.regressionplots
+        except AttributeError:
+            return importlib.import_module(f'{self._name}.{attr}')
+
+
+
+def lazy_import(name):
+    """Returns a plotting module that is only imported when first used."""
+
+    return LazyModule(name)
+
+
+
+def plot_frame(data):
+    """Returns data for pandas plotting calls (data.boxplot(), data.hist())
+    or a skipped plot in compute-only mode."""
+
+    if compute_only:
+        return skipped
+
+    return data
+
+
+
+plt = lazy_import('matplotlib.pyplot') # data visualization
+
+sns = lazy_import('seaborn') # more data visualization
+
+
+
+###############################################################################
+# Rendering figures in parallel
+###############################################################################
+
+"""
+    A figure spec is a dictionary describing one saved figure:
+
+        {'filename' : 'Diamond Data Histograms 2 of 3.png',
+         'source'   : 'diamonds_imputed',
+         'panels'   : [{'subplot' : (2, 2, 1),
+                        'func'    : 'sns.histplot',
+                        'kwargs'  : {'x' : 'cut', 'color' : 'navy'},
+                        'xlabel'  : 'Cut'},
+                       ...]}
+
+    source is the stage (or workbook) the data comes from; each worker
+    opens it through its memory-mapped column store, so the data is never
+    copied between processes. A panel can narrow the data with 'query'
+    (a DataFrame.query string), drop rows with missing values
+    ('transform' : 'dropna') or use the correlation matrix instead
+    ('transform' : 'corr'). func names a plotting function: 'plt.<name>',
+    'sns.<name>' or 'frame.<name>' for a pandas method such as boxplot.
+    Figure-level seaborn functions (pairplot, lmplot, jointplot) make
+    their own figure and must be the only panel.
+"""
+
+FIGURE_LEVEL = ('sns.pairplot', 'sns.lmplot', 'sns.jointplot')
+
+
+# Data opened by this process, by source name
+_sources = {}
+
+
+
+def _init_worker():
+    """Selects the non-interactive backend in a rendering process."""
+
+    import matplotlib
+
+    matplotlib.use('Agg')
+
+
+
+def _panel_data(panel, source):
+    """Returns the data a panel is drawn from."""
+
+    from diamond_io import load_columns
+
+    source = panel.get('source', source)
+
+    if source not in _sources:
+        _sources[source] = load_columns(source)
+
+    data = _sources[source]
+
+    if 'query' in panel:
+        data = data.query(panel['query'])
+
+    if panel.get('transform') == 'dropna':
+        data = data.dropna()
+
+    if panel.get('transform') == 'corr':
+        data = data.corr(numeric_only = True).round(2)
+
+    return data
+
+
+
+def render_figure(spec):
+    """Draws and saves one figure spec, returning its file name."""
+
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    libraries = {'plt' : plt, 'sns' : sns}
+
+    panels = spec['panels']
+
+    if panels[0]['func'] not in FIGURE_LEVEL:
+        plt.figure(figsize = spec.get('figsize'))
+
+
+    for panel in panels:
+
+        if 'subplot' in panel:
+            plt.subplot(*panel['subplot'])
+
+
+        library, name = panel['func'].split('.')
+
+        kwargs = panel.get('kwargs', {})
+
+        if library == 'counts':
+
+            # drawn from cached bin counts, the rows are never loaded
+            import diamond_histograms
+
+            getattr(diamond_histograms, name)(
+                    source = panel.get('source', spec.get('source')),
+                    dropna = panel.get('transform') == 'dropna',
+                    **kwargs)
+
+        elif library == 'frame':
+            getattr(_panel_data(panel, spec.get('source')), name)(**kwargs)
+
+        else:
+            getattr(libraries[library], name)(
+                    data = _panel_data(panel, spec.get('source')), **kwargs)
+
+
+        for line in panel.get('axvlines', []):
+            plt.axvline(**line)
+
+        for setting in ('title', 'xlabel', 'ylabel'):
+            if setting in panel:
+                getattr(plt, setting)(panel[setting])
+
+
+    if 'suptitle' in spec:
+        plt.suptitle(spec['suptitle'])
+
+    plt.tight_layout()
+    plt.savefig(spec['filename'])
+    plt.close('all')
+
+    return spec['filename']
+
+
+
+def render_figures(specs, processes = None):
+    """Renders a list of figure specs across a pool of processes.
+
+    processes defaults to the number of cores; processes = 1 renders them
+    one after another in this process. Nothing is drawn in compute-only
+    mode. Returns the names of the files written.
+    """
+
+    if compute_only or not specs:
+        return []
+
+
+    # Building the column stores up front keeps the workers from racing
+    # to write them
+    from diamond_io import load_columns
+
+    for source in {panel.get('source', spec.get('source'))
+                   for spec in specs for panel in spec['panels']}:
+        load_columns(source, columns = [])
+
+
+    if processes == 1:
+
+        _init_worker()
+
+        return [render_figure(spec) for spec in specs]
+
+
+    with ProcessPoolExecutor(max_workers = processes,
+                             initializer = _init_worker) as pool:
+
+        return list(pool.map(render_figure, specs))
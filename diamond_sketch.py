@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+
+@author: ArthurFMendes
+
+Purpose:
+    This code is meant to estimate medians and other quantiles of columns
+    too large to sort in memory, using a small mergeable summary (a KLL
+    quantile sketch) that is built batch by batch.
+"""
+
+###############################################################################
+# Importing libraries
+###############################################################################
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np # fast arrays (sorting, random numbers)
+
+
+
+###############################################################################
+# KLL quantile sketch
+###############################################################################
+
+"""
+    The sketch keeps a few short sorted lists ("levels"). Values enter level
+    0; when a level is full it is sorted and every other value (starting at
+    a random position) moves up one level, where each value stands for
+    twice as many original values. Memory stays around 3 * k values no
+    matter how many values are added, and two sketches can be merged by
+    joining their levels.
+
+    Accuracy: the rank of an estimated quantile is off by at most about
+    1.7% of the number of values for k = 200 (with 99% probability), and
+    the error shrinks roughly in proportion to 1 / k. For the median this
+    means the estimate lies between the 48.3% and 51.7% quantiles.
+"""
+
+class KLLSketch:
+    """A mergeable quantile sketch for one numeric column."""
+
+    def __init__(self, k = 200, seed = None):
+
+        self.k = k
+        self.count = 0
+        self.min = np.inf
+        self.max = -np.inf
+
+        self._levels = [np.empty(0)]
+        self._rng = np.random.default_rng(seed)
+
+
+
+    def _capacity(self, level):
+        """Number of values a level may hold before it is compacted."""
+
+        depth = len(self._levels) - level - 1
+
+        return max(2, int(np.ceil(self.k * (2 / 3) ** depth)))
+
+
+
+    def update(self, values):
+        """Adds an array (or Series) of values; missing values are ignored."""
+
+        values = np.asarray(values, dtype = float).ravel()
+
+        values = values[~np.isnan(values)]
+
+        if len(values) == 0:
+            return self
+
+
+        self.count += len(values)
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+
+        self._levels[0] = np.concatenate([self._levels[0], values])
+
+        self._compress()
+
+        return self
+
+
+
+    def merge(self, other):
+        """Adds everything summarised by another sketch to this one."""
+
+        if other.count == 0:
+            return self
+
+        while len(self._levels) < len(other._levels):
+            self._levels.append(np.empty(0))
+
+        for level, values in enumerate(other._levels):
+            self._levels[level] = np.concatenate([self._levels[level],
+                                                  values])
+
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+        self._compress()
+
+        return self
+
+
+
+    def _compress(self):
+        """Compacts full levels until the sketch fits its capacity."""
+
+        level = 0
+
+        while level < len(self._levels):
+
+            values = self._levels[level]
+
+            if len(values) <= self._capacity(level):
+                level += 1
+                continue
+
+
+            if level + 1 == len(self._levels):
+                self._levels.append(np.empty(0))
+
+            values = np.sort(values)
+
+            # an odd value out stays on this level
+            if len(values) % 2:
+                values, kept = values[1:], values[:1]
+            else:
+                kept = values[:0]
+
+            promoted = values[self._rng.integers(2)::2]
+
+            self._levels[level] = kept
+
+            self._levels[level + 1] = np.concatenate(
+                                        [self._levels[level + 1], promoted])
+
+            # capacities depend on the number of levels, so start over
+            level = 0
+
+
+
+    def _weighted(self):
+        """Returns all stored values (sorted) with their cumulative weights."""
+
+        values = np.concatenate(self._levels)
+
+        weights = np.concatenate([np.full(len(level_values), 2 ** level)
+                                  for level, level_values
+                                  in enumerate(self._levels)])
+
+        order = np.argsort(values, kind = 'stable')
+
+        return values[order], np.cumsum(weights[order])
+
+
+
+    def quantile(self, q):
+        """Estimates the q quantile (q may be a number or an array)."""
+
+        if self.count == 0:
+            return np.nan
+
+        values, cumulative = self._weighted()
+
+        q = np.asarray(q, dtype = float)
+
+        positions = np.searchsorted(cumulative, q * cumulative[-1],
+                                    side = 'left')
+
+        estimate = values[np.minimum(positions, len(values) - 1)]
+
+        estimate = np.where(q <= 0, self.min, estimate)
+        estimate = np.where(q >= 1, self.max, estimate)
+
+        return estimate if estimate.ndim else float(estimate)
+
+
+
+    def median(self):
+        """Estimates the median."""
+
+        return self.quantile(0.5)
+
+
+
+    def rank(self, value):
+        """Estimates the share of values less than or equal to value."""
+
+        if self.count == 0:
+            return np.nan
+
+        values, cumulative = self._weighted()
+
+        position = np.searchsorted(values, value, side = 'right')
+
+        below = np.where(position > 0,
+                         cumulative[np.maximum(position - 1, 0)], 0)
+
+        return below / cumulative[-1]
+
+
+
+    def size(self):
+        """Returns the number of values stored in the sketch."""
+
+        return sum(len(values) for values in self._levels)
+
+
+
+###############################################################################
+# Sketching columns
+###############################################################################
+
+def column_sketches(batches, columns, k = 200, seed = None):
+    """Builds one sketch per column while the batches stream in."""
+
+    sketches = {col : KLLSketch(k, seed) for col in columns}
+
+    for batch in batches:
+        for col in columns:
+            sketches[col].update(batch[col].to_numpy())
+
+    return sketches
+
+
+
+def merge_sketches(parts):
+    """Merges lists of per-column sketches (one dict per worker)."""
+
+    parts = list(parts)
+
+    merged = parts[0]
+
+    for part in parts[1:]:
+        for col, sketch in part.items():
+            merged[col].merge(sketch)
+
+    return merged
+
+
+
+def _sketch_row_group(args):
+    """Sketches the columns of one parquet row group (in a worker)."""
+
+    import pyarrow.parquet as pq
+
+    path, row_group, columns, k = args
+
+    batch = pq.ParquetFile(path).read_row_group(row_group, columns = columns)
+
+    return column_sketches([batch.to_pandas()], columns, k,
+                           seed = row_group)
+
+
+
+def sketch_parquet(path, columns, k = 200, processes = None):
+    """Sketches columns of a parquet file, one row group per task, across a
+    pool of processes, and merges the results."""
+
+    import pyarrow.parquet as pq
+
+    row_groups = pq.ParquetFile(path).num_row_groups
+
+    tasks = [(path, row_group, list(columns), k)
+             for row_group in range(row_groups)]
+
+    with ProcessPoolExecutor(max_workers = processes) as pool:
+        return merge_sketches(pool.map(_sketch_row_group, tasks))
+
+
+
+def approximate_medians(batches, columns, k = 200):
+    """Estimates the median of each column over a stream of batches."""
+
+    return {col : sketch.median()
+            for col, sketch in column_sketches(batches, columns, k).items()}
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+
+@author: ArthurFMendes
+
+Purpose:
+    This code is meant to keep the missing value report and the summary
+    statistics of stage 6 (isnull().sum(), the missing ratios and
+    describe()) up to date as new batches of diamonds are appended, without
+    scanning the rows that were already summarised.
+"""
+
+###############################################################################
+# Importing libraries
+###############################################################################
+
+import pickle
+
+import numpy as np # fast arrays (sums, min and max)
+import pandas as pd # data science essentials (DataFrame, Series)
+
+from diamond_io import stage_path
+from diamond_missing import _profile_frame
+from diamond_sketch import KLLSketch
+
+
+
+###############################################################################
+# Running aggregates
+###############################################################################
+
+"""
+    For every column the summary keeps the number of values present, the
+    number missing, their sum, sum of squares, minimum, maximum and a KLL
+    sketch for the quartiles. Adding a batch only touches the batch, and
+    the report is built from these few numbers, so its cost does not grow
+    with the data. Quartiles are estimates (see diamond_sketch); counts,
+    means, standard deviations, minima and maxima are exact.
+"""
+
+# file next to the stage file that holds its summary
+SUMMARY_EXT = '.summary.pkl'
+
+
+
+class RunningSummary:
+    """Aggregates of every column, updated one batch at a time."""
+
+    def __init__(self, k = 200):
+
+        self.k = k
+        self.rows = 0
+        self.columns = {}
+
+
+
+    def _column(self, col):
+        """Returns the aggregates of a column, creating them if needed."""
+
+        if col not in self.columns:
+            self.columns[col] = {'count'  : 0,
+                                 'nulls'  : 0,
+                                 'sum'    : 0.0,
+                                 'sumsq'  : 0.0,
+                                 'min'    : np.inf,
+                                 'max'    : -np.inf,
+                                 'sketch' : KLLSketch(self.k)}
+
+        return self.columns[col]
+
+
+
+    def update(self, batch):
+        """Adds a batch (a DataFrame) to the summary."""
+
+        for col in batch.columns:
+
+            if batch[col].dtype.kind not in 'iufb':
+                continue
+
+            values = batch[col].to_numpy(dtype = float, na_value = np.nan)
+
+            present = values[~np.isnan(values)]
+
+            stats = self._column(col)
+
+            stats['count'] += len(present)
+            stats['nulls'] += len(values) - len(present)
+
+            if len(present) == 0:
+                continue
+
+            stats['sum'] += present.sum()
+            stats['sumsq'] += present @ present
+            stats['min'] = min(stats['min'], present.min())
+            stats['max'] = max(stats['max'], present.max())
+
+            stats['sketch'].update(present)
+
+
+        self.rows += len(batch)
+
+        return self
+
+
+
+    def merge(self, other):
+        """Adds everything summarised by another summary to this one."""
+
+        for col, theirs in other.columns.items():
+
+            stats = self._column(col)
+
+            for key in ('count', 'nulls', 'sum', 'sumsq'):
+                stats[key] += theirs[key]
+
+            stats['min'] = min(stats['min'], theirs['min'])
+            stats['max'] = max(stats['max'], theirs['max'])
+
+            stats['sketch'].merge(theirs['sketch'])
+
+
+        self.rows += other.rows
+
+        return self
+
+
+
+    def profile(self):
+        """Returns the missing value profile (as profile_missing does)."""
+
+        missing = pd.Series({col : stats['nulls']
+                             for col, stats in self.columns.items()},
+                            dtype = 'int64')
+
+        return _profile_frame(missing, self.rows)
+
+
+
+    def describe(self):
+        """Returns count, mean, std, min, quartiles and max of every column,
+        laid out like DataFrame.describe()."""
+
+        summary = {}
+
+        for col, stats in self.columns.items():
+
+            n = stats['count']
+
+            mean = stats['sum'] / n if n else np.nan
+
+            if n > 1:
+                variance = (stats['sumsq'] - n * mean ** 2) / (n - 1)
+                std = np.sqrt(max(variance, 0.0))
+            else:
+                std = np.nan
+
+            quartiles = stats['sketch'].quantile([0.25, 0.5, 0.75])
+
+            summary[col] = [n, mean, std,
+                            stats['min'] if n else np.nan,
+                            *np.atleast_1d(quartiles).tolist(),
+                            stats['max'] if n else np.nan]
+
+
+        return pd.DataFrame(summary,
+                            index = ['count', 'mean', 'std', 'min',
+                                     '25%', '50%', '75%', 'max'])
+
+
+
+    def save(self, name):
+        """Saves the summary next to the stage file <name>."""
+
+        with open(stage_path(name, SUMMARY_EXT), 'wb') as handle:
+            pickle.dump(self, handle)
+
+
+
+    @classmethod
+    def load(cls, name, k = 200):
+        """Loads the summary of stage <name> (empty if there is none)."""
+
+        try:
+            with open(stage_path(name, SUMMARY_EXT), 'rb') as handle:
+                return pickle.load(handle)
+
+        except FileNotFoundError:
+            return cls(k)
+
+
+
+def append_summary(name, batch):
+    """Adds a newly arrived batch to the saved summary of stage <name> and
+    returns the updated summary."""
+
+    summary = RunningSummary.load(name).update(batch)
+
+    summary.save(name)
+
+    return summary
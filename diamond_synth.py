@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+
+@author: ArthurFMendes
+
+Purpose:
+    This code is meant to generate synthetic diamond data that looks like
+    diamonds_missing_values.xlsx (same columns, value ranges, store and
+    channel mix, price vs. carat relationship and missing values), in any
+    number of rows, for benchmarks and load tests.
+"""
+
+###############################################################################
+# Importing libraries
+###############################################################################
+
+import argparse
+
+import numpy as np # fast arrays (random numbers, least squares)
+import pandas as pd # data science essentials
+
+from diamond_io import RAW_SCHEMA, load_columns, stage_path
+from diamond_missing import MISSING_COLUMNS
+
+
+
+###############################################################################
+# Learning the shape of the data
+###############################################################################
+
+def _frequencies(values):
+    """Returns the distinct values of a column and how often they occur."""
+
+    counts = values.dropna().value_counts().sort_index()
+
+    return counts.index.to_numpy(), (counts / counts.sum()).to_numpy()
+
+
+
+def _price_design(carat, color, clarity, cut, channel):
+    """Columns of the log(price) model: carat (and its square), color,
+    clarity, cut and the channel."""
+
+    return np.column_stack([np.ones(len(carat)),
+                            carat,
+                            carat ** 2,
+                            color,
+                            clarity,
+                            cut,
+                            channel == 1,
+                            channel == 2])
+
+
+
+def fit_profile(diamonds):
+    """Summarises a diamond dataset into what the generator needs.
+
+    The profile holds the store mix (and the channel of each store), the
+    log-normal carat distribution of each channel, the frequencies of
+    color, clarity and cut, a log(price) regression with its residual
+    spread, and the share of missing values in each column.
+    """
+
+    profile = {}
+
+    profile['stores'], profile['store_p'] = _frequencies(diamonds['store'])
+
+    # every store sells through a single channel
+    profile['store_channel'] = (diamonds.groupby('store')['channel']
+                                        .first()
+                                        .loc[profile['stores']]
+                                        .to_numpy())
+
+
+    log_carat = np.log(diamonds['carat'])
+
+    profile['carat_mu'] = log_carat.groupby(diamonds['channel']).mean()
+    profile['carat_sd'] = log_carat.groupby(diamonds['channel']).std()
+
+    profile['carat_range'] = (diamonds['carat'].min(),
+                              diamonds['carat'].max())
+
+
+    for col in ['color', 'clarity', 'cut']:
+        profile[col] = _frequencies(diamonds[col])
+
+
+    complete = diamonds.dropna()
+
+    design = _price_design(*[complete[col].to_numpy(dtype = float)
+                             for col in ['carat', 'color', 'clarity', 'cut',
+                                         'channel']])
+
+    log_price = np.log(complete['price'].to_numpy(dtype = float))
+
+    profile['price_coef'] = np.linalg.lstsq(design, log_price,
+                                            rcond = None)[0]
+
+    profile['price_sd'] = (log_price - design @ profile['price_coef']).std()
+
+
+    profile['missing'] = {col : diamonds[col].isnull().mean()
+                          for col in MISSING_COLUMNS}
+
+    return profile
+
+
+
+###############################################################################
+# Generating rows
+###############################################################################
+
+def generate_batches(rows, batch_size = 1000000, seed = 0, profile = None):
+    """Yields synthetic diamonds as DataFrames of at most batch_size rows.
+
+    Only one batch exists in memory at a time, so the number of rows is
+    not limited by memory. The same seed always gives the same data.
+    """
+
+    if profile is None:
+        profile = fit_profile(load_columns('diamonds_missing_values.xlsx'))
+
+    rng = np.random.default_rng(seed)
+
+    done = 0
+
+    while done < rows:
+
+        size = min(batch_size, rows - done)
+
+        yield _batch(rng, profile, size, first_obs = done + 1)
+
+        done += size
+
+
+
+def _batch(rng, profile, size, first_obs):
+    """Draws one batch of synthetic diamonds."""
+
+    store_pick = rng.choice(len(profile['stores']), size,
+                            p = profile['store_p'])
+
+    store = profile['stores'][store_pick]
+
+    channel = profile['store_channel'][store_pick]
+
+
+    carat = np.exp(rng.normal(profile['carat_mu'].loc[channel].to_numpy(),
+                              profile['carat_sd'].loc[channel].to_numpy()))
+
+    carat = np.clip(carat, *profile['carat_range']).round(2)
+
+
+    codes = {}
+
+    for col in ['color', 'clarity', 'cut']:
+
+        values, p = profile[col]
+
+        codes[col] = rng.choice(values, size, p = p)
+
+
+    log_price = (_price_design(carat, codes['color'], codes['clarity'],
+                               codes['cut'], channel) @ profile['price_coef'] +
+                 rng.normal(0, profile['price_sd'], size))
+
+
+    diamonds = pd.DataFrame({'Obs'     : np.arange(first_obs,
+                                                   first_obs + size),
+                             'carat'   : carat,
+                             'color'   : codes['color'],
+                             'clarity' : codes['clarity'],
+                             'cut'     : codes['cut'],
+                             'channel' : channel,
+                             'store'   : store,
+                             'price'   : np.exp(log_price).round()})
+
+
+    # missing values are spread at random, as in the bundled data
+    for col, share in profile['missing'].items():
+        diamonds.loc[rng.random(size) < share, col] = np.nan
+
+    return diamonds.astype(RAW_SCHEMA)
+
+
+
+def synthetic_frame(rows, seed = 0, profile = None):
+    """Returns rows synthetic diamonds as a single DataFrame."""
+
+    return next(generate_batches(rows, batch_size = max(rows, 1),
+                                 seed = seed, profile = profile))
+
+
+
+###############################################################################
+# Writing synthetic data
+###############################################################################
+
+def write_synthetic(name, rows, batch_size = 1000000, seed = 0):
+    """Writes synthetic diamonds to <name>.parquet, one batch at a time.
+
+    Each batch becomes a row group, so the file can be read back in
+    batches as well. Returns the file name.
+    """
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    path = stage_path(name)
+
+    writer = None
+
+    try:
+        for batch in generate_batches(rows, batch_size, seed):
+
+            # batches already share RAW_SCHEMA, so every row group has
+            # the same column types
+            table = pa.Table.from_pandas(batch, preserve_index = False)
+
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema)
+
+            writer.write_table(table)
+
+    finally:
+        if writer is not None:
+            writer.close()
+
+    return path
+
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description = __doc__)
+
+    parser.add_argument('rows', type = int)
+
+    parser.add_argument('--output', default = 'diamonds_synthetic')
+
+    parser.add_argument('--batch-size', type = int, default = 1000000)
+
+    parser.add_argument('--seed', type = int, default = 0)
+
+    args = parser.parse_args()
+
+    print(write_synthetic(args.output, args.rows, args.batch_size, args.seed))
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+
+@author: ArthurFMendes
+
+Purpose:
+    This code is meant to keep versions (snapshots) of the diamond dataset
+    in memory, so that a script can go back to an earlier state of the data
+    (for example before the missing value flags were added) without
+    loading the file again.
+"""
+
+###############################################################################
+# Importing libraries
+###############################################################################
+
+import pandas as pd # data science essentials (DataFrame)
+
+
+
+###############################################################################
+# Copy-on-write
+###############################################################################
+
+"""
+    Snapshots are shallow copies: a snapshot and the dataset share the
+    memory of every column until one of them changes it. With pandas'
+    copy-on-write mode (the only mode from pandas 3.0 on) the column that
+    is changed is copied at that moment and the other one keeps its values,
+    so taking or restoring a snapshot costs the same whatever the number of
+    rows and unchanged columns are never duplicated.
+"""
+
+if int(pd.__version__.split('.')[0]) < 3:
+    pd.set_option('mode.copy_on_write', True)
+
+
+
+###############################################################################
+# Snapshots
+###############################################################################
+
+class Snapshots:
+    """Numbered (and optionally named) versions of a DataFrame."""
+
+    def __init__(self):
+
+        self._versions = []
+        self._names = {}
+
+
+
+    def snapshot(self, diamonds, name = None):
+        """Keeps the current state of diamonds and returns its version."""
+
+        self._versions.append(diamonds.copy(deep = False))
+
+        version = len(self._versions) - 1
+
+        if name is not None:
+            self._names[name] = version
+
+        return version
+
+
+
+    def restore(self, version = -1):
+        """Returns a version (by number or name; the latest by default).
+
+        The result can be changed freely; the snapshot keeps its values,
+        so the same version can be restored, or branched from, any number
+        of times.
+        """
+
+        if isinstance(version, str):
+            version = self._names[version]
+
+        return self._versions[version].copy(deep = False)
+
+
+
+    def versions(self):
+        """Returns the version numbers with their names (if any)."""
+
+        names = {version : name for name, version in self._names.items()}
+
+        return [(version, names.get(version))
+                for version in range(len(self._versions))]
+
+
+
+    def __len__(self):
+
+        return len(self._versions)